@@ -1,11 +1,14 @@
+import os
 import logging
 import asyncio
 import signal
-import traceback
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, PicklePersistence
+import platform
+import httpx
+from types import SimpleNamespace
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, PicklePersistence
 from telegram import Update
-from config import BOT_TOKEN, ADMINS, DB_ENGINE
-from telegram.ext import DictPersistence
+from telegram.request import HTTPXRequest
+from config import BOT_TOKEN, DATA_DIR, USE_WEBHOOK, WEBHOOK_BASE, WEBHOOK_LISTEN, WEBHOOK_PORT
 
 from services.quiz_service import QuizService
 from services.parent_service import ParentService
@@ -16,7 +19,7 @@ from handlers.parent import ParentHandler
 from handlers.admin import AdminHandler
 from handlers.common import CommonHandler
 
-from database.db_manager import init_db, get_session, engine
+from database.db_manager import init_db, get_last_update_id, save_last_update_id
 from services.notification import NotificationService
 
 # Настройка логирования
@@ -25,8 +28,71 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+# SQLAlchemy пишет в лог только предупреждения и ошибки
+logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
 logger = logging.getLogger(__name__)
 
+# uvloop ускоряет цикл событий на Linux/macOS; на Windows и без пакета остается стандартный цикл
+try:
+    import uvloop
+    uvloop.install()
+    logger.info("Используется uvloop")
+except ImportError:
+    pass
+
+# Команды бота: (команда, обработчик, метод)
+COMMANDS = (
+    # Команды для всех пользователей
+    ("start", "start", "start_command"),
+    ("help", "start", "help_command"),
+    ("mycode", "start", "mycode_command"),
+    # Команды для учеников
+    ("test", "student", "start_test"),
+    ("stats", "student", "show_stats"),
+    ("achievements", "student", "show_achievements"),
+    # Команды для родителей
+    ("link", "parent", "link_student"),
+    ("report", "parent", "get_report"),
+    ("settings", "parent", "settings"),
+    # Команды для администраторов
+    ("admin", "admin", "admin_panel"),
+    ("add_question", "admin", "add_question"),
+    ("import", "admin", "import_questions"),
+    ("export_excel", "admin", "export_to_excel"),
+)
+
+# Кнопки: префикс callback_data -> (обработчик, метод)
+CALLBACKS = {
+    "common_": ("common", "handle_common_button"),
+    "quiz_": ("student", "handle_test_button"),
+    "student_": ("student", "handle_test_button"),
+    "parent_": ("parent", "handle_parent_button"),
+    "admin_": ("admin", "handle_admin_button"),
+}
+
+
+class KeepAliveHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, который дольше держит простаивающие соединения открытыми.
+
+    По умолчанию httpx закрывает соединение после 5 секунд простоя, и следующий запрос
+    к Telegram снова проходит TCP/TLS handshake.
+    """
+
+    def __init__(self, *args, keepalive_expiry: float = 120, **kwargs):
+        # _build_client вызывается из конструктора родителя, поэтому значение задаем заранее
+        self._keepalive_expiry = keepalive_expiry
+        super().__init__(*args, **kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = self._client_kwargs["limits"]
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self._keepalive_expiry
+        )
+        return super()._build_client()
+
 
 class HistoryBot:
     def __init__(self, token):
@@ -35,6 +101,8 @@ class HistoryBot:
         self.notification_service = None
         self.running = False
         self._shutdown_event = None
+        # Последний обработанный update_id, сохраняется в БД при остановке
+        self._last_update_id = None
 
         # Сервисы
         self.quiz_service = None
@@ -47,24 +115,45 @@ class HistoryBot:
         self.admin_handler = None
         self.common_handler = None
 
-        # Добавим словарь для быстрого доступа к обработчикам
-        self.handlers = {}
+        # Пространство имен для быстрого доступа к обработчикам: self.handlers.student
+        self.handlers = SimpleNamespace()
+        # Обработчики кнопок: параллельные кортежи префиксов callback_data и методов
+        self._cb_prefixes = ()
+        self._cb_methods = ()
 
     async def start(self):
         """Запуск бота"""
+        # Событие завершения создаем сразу, чтобы сигнал, пришедший во время запуска, не потерялся
+        self._shutdown_event = asyncio.Event()
+        # Установка обработчиков сигналов для корректного завершения - до любых долгих операций
+        self._setup_signal_handlers()
         try:
             # Инициализация базы данных
             init_db()
 
             # создаем экземпляр приложения
-            persistence = DictPersistence()
+            # Состояние bot_data/user_data/chat_data сохраняется на диск и переживает перезапуск
+            persistence = PicklePersistence(
+                filepath=os.path.join(DATA_DIR, "ptb_state.pkl"),
+                update_interval=60,
+                single_file=False
+            )
+            # Большой пул соединений и HTTP/2 для параллельной отправки сообщений
+            request = KeepAliveHTTPXRequest(
+                connection_pool_size=256,
+                read_timeout=30,
+                write_timeout=30,
+                connect_timeout=30,
+                pool_timeout=30,
+                http_version="2"
+            )
+            # getUpdates выполняется по одному запросу, ему достаточно небольшого пула
+            get_updates_request = HTTPXRequest(connection_pool_size=8, http_version="2")
             self.application = (
                 Application.builder()
                 .token(self.token)
-                .read_timeout(30)
-                .write_timeout(30)
-                .connect_timeout(30)
-                .pool_timeout(30)
+                .request(request)
+                .get_updates_request(get_updates_request)
                 .persistence(persistence)
                 .build()
             )
@@ -87,10 +176,8 @@ class HistoryBot:
             # Инициализация обработчиков
             self._initialize_handlers()
 
-            # Сохраняем ссылки в контексте приложения
-            self.application.bot_data["handlers"] = self.handlers
-            self.application.bot_data["quiz_service"] = self.quiz_service  # Добавляем для доступа
-
+            # Обработчики и сервисы не кладем в bot_data: объекты не сериализуются pickle,
+            # ссылки на них хранятся в self.handlers и self.quiz_service
 
             # Восстанавливаем состояние активных тестов
             self.quiz_service.restore_active_quizzes()
@@ -104,9 +191,6 @@ class HistoryBot:
             # Регистрация обработчиков команд
             self._register_handlers()
 
-            # Установка обработчиков сигналов для корректного завершения
-            self._setup_signal_handlers()
-
             # Инициализация команд бота по умолчанию
             await self._setup_default_commands()
 
@@ -115,23 +199,44 @@ class HistoryBot:
 
             # Запуск бота
             self.running = True
+            # initialize() вызывает getMe, так что TLS-соединение с API уже установлено
             await self.application.initialize()
+            logger.info("Пул соединений прогрет, бот @%s", self.application.bot.username)
             await self.application.start()
             logger.info("Bot started")
 
-            # Запускаем polling и ждем завершения
-            await self.application.updater.start_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
+            # Получаем обновления через webhook (production) или polling (разработка)
+            if USE_WEBHOOK:
+                await self.application.updater.start_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=self.token,
+                    webhook_url=f"{WEBHOOK_BASE}/{self.token}",
+                    allowed_updates=Update.ALL_TYPES,
+                    # Обновления, пришедшие во время простоя, не сбрасываются, как и в режиме polling
+                    drop_pending_updates=False
+                )
+                logger.info("Webhook запущен на %s:%s", WEBHOOK_LISTEN, WEBHOOK_PORT)
+            else:
+                # Вместо сброса очереди подтверждаем только уже обработанные обновления:
+                # Telegram удалит их, а пришедшие во время простоя будут обработаны
+                last_update_id = get_last_update_id()
+                if last_update_id is not None:
+                    # После работы в режиме webhook он еще зарегистрирован, и getUpdates
+                    # вернул бы 409 Conflict; ожидающие обновления при этом сохраняются
+                    await self.application.bot.delete_webhook(drop_pending_updates=False)
+                    await self.application.bot.get_updates(offset=last_update_id + 1, limit=1, timeout=0)
+                await self.application.updater.start_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=False
+                )
+                logger.info("Polling запущен")
 
-            # Используем Event для управления жизненным циклом вместо цикла со sleep
-            self._shutdown_event = asyncio.Event()
+            # Ждем события завершения: цикл событий не просыпается до сигнала
             await self._shutdown_event.wait()
 
         except Exception as e:
-            logger.error(f"Error during bot execution: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error during bot execution: %s", e)
         finally:
             await self.shutdown()
 
@@ -148,8 +253,7 @@ class HistoryBot:
             else:
                 logger.warning("Не удалось установить стандартные команды бота")
         except Exception as e:
-            logger.error(f"Ошибка при установке стандартных команд бота: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка при установке стандартных команд бота: %s", e)
 
     def _initialize_handlers(self):
         """Инициализация обработчиков"""
@@ -172,51 +276,35 @@ class HistoryBot:
             start_handler=self.start_handler
         )
 
-        # Заполняем словарь обработчиков для удобного доступа
-        self.handlers = {
-            "start": self.start_handler,
-            "student": self.student_handler,
-            "parent": self.parent_handler,
-            "admin": self.admin_handler,
-            "common": self.common_handler
-        }
+        # Заполняем пространство имен обработчиков для удобного доступа
+        self.handlers = SimpleNamespace(
+            start=self.start_handler,
+            student=self.student_handler,
+            parent=self.parent_handler,
+            admin=self.admin_handler,
+            common=self.common_handler
+        )
+
+        # Разворачиваем таблицу кнопок в два плоских кортежа для быстрого перебора.
+        # Отсутствующий метод - ошибка программы: AttributeError прервет запуск
+        self._cb_prefixes = tuple(CALLBACKS)
+        self._cb_methods = tuple(
+            getattr(getattr(self.handlers, handler_name), method_name)
+            for handler_name, method_name in CALLBACKS.values()
+        )
 
     def _register_handlers(self) -> None:
         """Регистрация обработчиков команд"""
-        # Команды для всех пользователей
-        self.application.add_handler(CommandHandler("start", self.start_handler.start_command))
-        self.application.add_handler(CommandHandler("help", self.start_handler.help_command))
-        self.application.add_handler(CommandHandler("mycode", self.start_handler.mycode_command))
-
-        # Команды для учеников
-        self.application.add_handler(CommandHandler("test", self.student_handler.start_test))
-        self.application.add_handler(CommandHandler("stats", self.student_handler.show_stats))
-        self.application.add_handler(CommandHandler("achievements", self.student_handler.show_achievements))
-
-        # Команды для родителей
-        self.application.add_handler(CommandHandler("link", self.parent_handler.link_student))
-        self.application.add_handler(CommandHandler("report", self.parent_handler.get_report))
-        self.application.add_handler(CommandHandler("settings", self.parent_handler.settings))
-
-        # Команды для администраторов
-        self.application.add_handler(CommandHandler("admin", self.admin_handler.admin_panel))
-        self.application.add_handler(CommandHandler("add_question", self.admin_handler.add_question))
-        self.application.add_handler(CommandHandler("import", self.admin_handler.import_questions))
-        self.application.add_handler(CommandHandler("export_excel", self.admin_handler.export_to_excel))
-
-        # Обработчики кнопок
-        self.application.add_handler(CallbackQueryHandler(self.common_handler.handle_common_button, pattern="^common_"))
-        self.application.add_handler(CallbackQueryHandler(self.student_handler.handle_test_button, pattern="^quiz_"))
-        self.application.add_handler(CallbackQueryHandler(self.student_handler.handle_test_button, pattern="^student_"))
-        self.application.add_handler(CallbackQueryHandler(self.parent_handler.handle_parent_button, pattern="^parent_"))
-
-
-        # Проверяем наличие метода у админ обработчика
-        if hasattr(self.admin_handler, 'handle_admin_button'):
+        # Учет последнего update_id: группа -1 видит каждое обновление раньше остальных обработчиков
+        self.application.add_handler(TypeHandler(Update, self._track_update_id), group=-1)
+
+        # Команды: (команда, обработчик, метод)
+        for command, handler_name, method_name in COMMANDS:
             self.application.add_handler(
-                CallbackQueryHandler(self.admin_handler.handle_admin_button, pattern="^admin_"))
-        else:
-            logger.error("AdminHandler doesn't have method 'handle_admin_button', skipping registration")
+                CommandHandler(command, getattr(getattr(self.handlers, handler_name), method_name)))
+
+        # Обработчики кнопок: один CallbackQueryHandler, метод выбирается по префиксу callback_data
+        self.application.add_handler(CallbackQueryHandler(self._dispatch_callback))
 
         # Обработка документов (для импорта вопросов)
         self.application.add_handler(MessageHandler(filters.Document.ALL, self.admin_handler.handle_document))
@@ -228,29 +316,36 @@ class HistoryBot:
         # Обработчик ошибок
         self.application.add_error_handler(self.common_handler.error_handler)
 
+    async def _track_update_id(self, update: Update, context) -> None:
+        """Запоминает наибольший полученный update_id"""
+        if self._last_update_id is None or update.update_id > self._last_update_id:
+            self._last_update_id = update.update_id
+
+    async def _dispatch_callback(self, update: Update, context) -> None:
+        """Передает нажатие кнопки обработчику по префиксу callback_data"""
+        data = update.callback_query.data or ""
+        for prefix, method in zip(self._cb_prefixes, self._cb_methods):
+            if data.startswith(prefix):
+                await method(update, context)
+                return
+        # Неизвестная кнопка: отвечаем на запрос, чтобы клиент не показывал загрузку
+        logger.warning("Нет обработчика для callback_data: %s", data)
+        await update.callback_query.answer()
+
     def _setup_signal_handlers(self):
         """Настройка обработчиков сигналов"""
-        import platform
         if platform.system() != 'Windows':
-            import signal
             loop = asyncio.get_running_loop()
+            # Сигнал только устанавливает событие, завершение выполняет finally в start()
             for sig in (signal.SIGINT, signal.SIGTERM):
-                loop.add_signal_handler(
-                    sig,
-                    lambda s=sig: asyncio.create_task(self._handle_signal(s.name))
-                )
-
-    async def _handle_signal(self, signal_name):
-        """Обработчик сигнала завершения"""
-        logger.info(f"Получен сигнал {signal_name}, запускаем корректное завершение")
-        await self.shutdown(signal_name)
+                loop.add_signal_handler(sig, self._shutdown_event.set)
 
     async def shutdown(self, signal_name=None):
         """Корректное завершение работы бота"""
         if not self.running:
             return
 
-        logger.info(f"Shutting down bot{f' (signal: {signal_name})' if signal_name else ''}")
+        logger.info("Shutting down bot%s", f" (signal: {signal_name})" if signal_name else "")
         self.running = False
 
         # Устанавливаем событие завершения
@@ -269,7 +364,7 @@ class HistoryBot:
             if self.notification_service:
                 await self.notification_service.stop()
 
-            # Останавливаем polling
+            # Останавливаем polling/webhook
             if self.application and self.application.updater.running:
                 await self.application.updater.stop()
 
@@ -278,11 +373,14 @@ class HistoryBot:
                 await self.application.stop()
                 await self.application.shutdown()
 
+            # Сохраняем последний обработанный update_id для следующего запуска
+            if self._last_update_id is not None:
+                save_last_update_id(self._last_update_id)
+
             logger.info("Bot shutdown complete")
 
         except Exception as e:
-            logger.error(f"Error during shutdown: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error during shutdown: %s", e)
 
 async def main():
     """Запуск бота"""
@@ -296,5 +394,4 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Critical error: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Critical error: %s", e)
@@ -1,6 +1,9 @@
 import os
+import logging
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
@@ -9,11 +12,33 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 
 # Идентификаторы администраторов (список строк с ID)
 ADMINS = [admin_id.strip() for admin_id in os.getenv('ADMINS', '').split(',') if admin_id.strip()]
+# Те же идентификаторы числами - для проверки прав за O(1) без создания строк.
+# Нечисловые записи (опечатка, @username) пропускаются, чтобы бот все равно запустился
+ADMIN_IDS = frozenset(int(admin_id) for admin_id in ADMINS if admin_id.lstrip('-').isdigit())
+for admin_id in ADMINS:
+    if not admin_id.lstrip('-').isdigit():
+        logger.warning("Некорректный ID администратора в ADMINS пропущен: %s", admin_id)
 
 # Настройки подключения к базе данных
 db_path = os.path.join('data', 'history_bot.db')
 DB_ENGINE = os.getenv('DB_ENGINE', f'sqlite:///{db_path}')
 
+# Режим получения обновлений: webhook для production, polling для разработки
+USE_WEBHOOK = os.getenv('USE_WEBHOOK', 'False').lower() == 'true'
+# Внешний HTTPS-адрес, на котором nginx принимает запросы Telegram (например, https://bot.example.com)
+WEBHOOK_BASE = os.getenv('WEBHOOK_BASE', '').rstrip('/')
+# Внутренний адрес и порт, на которые nginx проксирует запросы
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+if USE_WEBHOOK and not WEBHOOK_BASE:
+    raise ValueError("USE_WEBHOOK включен, но WEBHOOK_BASE не задан")
+
+# Открывать все соединения пула PostgreSQL при старте (можно отключить для тестов)
+PREWARM_POOL = os.getenv('PREWARM_POOL', 'True').lower() == 'true'
+
+# Подсчет SQL-запросов в обработчиках для поиска N+1 (только для разработки)
+DEBUG_SQL = os.getenv('DEBUG_SQL', 'False').lower() == 'true'
+
 # Настройки бота
 ENABLE_PARENT_REPORTS = os.getenv('ENABLE_PARENT_REPORTS', 'True').lower() == 'true'
 
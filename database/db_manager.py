@@ -1,14 +1,19 @@
+import asyncio
+import contextvars
+import functools
 import logging
 import os
-import traceback
+import time
 from contextlib import contextmanager
-from typing import Optional, Generator
-from sqlalchemy import create_engine, event, exc, pool
-from sqlalchemy.orm import sessionmaker, scoped_session, Session as SQLAlchemySession
+from functools import lru_cache
+from typing import Optional, Generator, Dict, List
+from sqlalchemy import create_engine, event, exc, inspect, pool, text, insert, select, exists, literal, union_all
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import sessionmaker, selectinload, Session as SQLAlchemySession
 from sqlalchemy.exc import SQLAlchemyError
 
-from config import DB_ENGINE, DATA_DIR, ADMINS
-from database.models import Base
+from config import DB_ENGINE, DATA_DIR, ADMINS, PREWARM_POOL, DEBUG_SQL
+from database.models import Base, AppMeta, User, Topic, BotState
 
 logger = logging.getLogger(__name__)
 
@@ -16,11 +21,25 @@ logger = logging.getLogger(__name__)
 is_sqlite = DB_ENGINE.startswith('sqlite:///')
 is_postgres = DB_ENGINE.startswith('postgresql://')
 
+# INSERT с поддержкой ON CONFLICT для используемого диалекта
+if is_postgres:
+    from sqlalchemy.dialects.postgresql import insert as dialect_insert
+else:
+    from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+# Запрос проверки соединения создаем один раз, чтобы не компилировать его при каждом вызове
+_PING = text("SELECT 1")
+
+# Размер кэша скомпилированных запросов: набор запросов бота фиксирован,
+# после прогрева все они должны браться из кэша без повторной компиляции
+QUERY_CACHE_SIZE = 1200
+
 # Создаем DB_ENGINE c настройками
 if is_postgres:
     engine = create_engine(
         DB_ENGINE,
         echo=False,
+        query_cache_size=QUERY_CACHE_SIZE,
         # Уменьшаем pool_size для стабильности
         pool_size=10,  # Было 20
         max_overflow=20,  # Было 30
@@ -40,34 +59,75 @@ if is_postgres:
         }
     )
 else:
-    # Для SQLite используем StaticPool для избежания проблем с потоками
+    # База в памяти существует только внутри одного соединения, поэтому для нее нужен StaticPool.
+    # Файловой базе StaticPool не нужен: с WAL читатели в разных потоках работают параллельно
+    # на собственных соединениях, а не ждут одно общее. Соединения держим в пуле, а не
+    # открываем на каждую сессию: иначе каждый раз заново выполняются PRAGMA и теряется
+    # кэш страниц соединения (cache_size)
+    is_memory = DB_ENGINE.endswith(":memory:")
+    if is_memory:
+        pool_options = {"poolclass": pool.StaticPool}
+    else:
+        pool_options = {"poolclass": pool.QueuePool, "pool_size": 5, "max_overflow": 10}
     engine = create_engine(
         DB_ENGINE,
         echo=False,
-        poolclass=pool.StaticPool,
-        connect_args={"check_same_thread": False}
+        query_cache_size=QUERY_CACHE_SIZE,
+        connect_args={"check_same_thread": False, "timeout": 30},
+        **pool_options
     )
 
-# Создаем фабрику сессий с автоматическим expire_on_commit=False для работы с объектами после коммита
-Session = scoped_session(sessionmaker(
+# Создаем фабрику сессий с автоматическим expire_on_commit=False для работы с объектами после коммита.
+# Каждый get_session() получает собственную сессию: scoped_session привязывал сессию к потоку,
+# и корутины в одном потоке asyncio делили одну транзакцию
+SessionFactory = sessionmaker(
     bind=engine,
-    autoflush=True,
+    autoflush=False,  # Изменения отправляются в БД при commit или явном flush, а не перед каждым запросом
     autocommit=False,
     expire_on_commit=False  # Важно! Позволяет использовать объекты после закрытия сессии
-))
+)
+# Старое имя оставлено для совместимости импортов
+Session = SessionFactory
+
+
+# PID текущего процесса. Кэшируем, чтобы не делать системный вызов на каждое получение
+# соединения из пула; после fork значение обновляется в дочернем процессе
+_PID = os.getpid()
+
+
+def _refresh_pid():
+    global _PID
+    _PID = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_refresh_pid)
 
 
 # Настройка обработчиков событий для улучшения стабильности
 @event.listens_for(engine, "connect")
 def connect(dbapi_connection, connection_record):
     """Обработчик события подключения к БД"""
-    connection_record.info['pid'] = os.getpid()
+    connection_record.info['pid'] = _PID
+
+
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        """Настройка SQLite: WAL-журнал, реже fsync, чтение страниц через mmap"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 МБ
+        cursor.execute("PRAGMA cache_size=-65536")  # 64 МБ
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
 
 @event.listens_for(engine, "checkout")
 def checkout(dbapi_connection, connection_record, connection_proxy):
     """Проверка соединения при получении из пула"""
-    pid = os.getpid()
+    pid = _PID
     if connection_record.info['pid'] != pid:
         # Соединение было создано в другом процессе, закрываем его
         connection_record.connection = connection_proxy.connection = None
@@ -77,62 +137,230 @@ def checkout(dbapi_connection, connection_record, connection_proxy):
         )
 
 
+# Счетчик SQL-запросов текущего обработчика. Хранится список, а не число: asyncio.to_thread
+# копирует контекст, и поток должен увеличивать тот же счетчик, что и обработчик
+_query_counter: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("query_counter", default=None)
+
+if DEBUG_SQL:
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        """Учет запроса в счетчике текущего обработчика"""
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+def count_queries(max_queries: int = 5):
+    """Декоратор async-обработчика: предупреждает, если он выполнил больше max_queries SQL-запросов.
+
+    Работает только при DEBUG_SQL, иначе возвращает обработчик без изменений.
+    """
+    def decorator(func):
+        if not DEBUG_SQL:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            counter = [0]
+            token = _query_counter.set(counter)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _query_counter.reset(token)
+                if counter[0] > max_queries:
+                    logger.warning("%s выполнил %d SQL-запросов (порог %d) - возможен N+1",
+                                   func.__qualname__, counter[0], max_queries)
+        return wrapper
+    return decorator
+
+
+# Начальные данные уже проверены в этом процессе
+_BOOTSTRAPPED = False
+
+
 def init_db():
     """Инициализация базы данных с улучшенной обработкой ошибок"""
+    global _BOOTSTRAPPED
     try:
-        # Проверяем подключение
-        logger.info(f"Подключение к базе данных: {DB_ENGINE}")
-        with engine.connect() as conn:
-            logger.info("Соединение с базой данных установлено успешно")
+        # Отдельная проверка подключения не нужна: create_all сам откроет соединение
+        logger.info("Подключение к базе данных: %s", DB_ENGINE)
+
+        # Одним чтением схемы узнаем существующие таблицы и создаем только недостающие:
+        # при обычном перезапуске create_all не проверяет каждую таблицу отдельным запросом
+        inspector = inspect(engine)
+        existing_tables = set(inspector.get_table_names())
+        missing_tables = [table for table in Base.metadata.sorted_tables if table.name not in existing_tables]
+        if missing_tables:
+            Base.metadata.create_all(engine, tables=missing_tables)
+            logger.info("Созданы таблицы: %s", ", ".join(table.name for table in missing_tables))
+        else:
+            logger.info("Все таблицы уже существуют")
 
+        # create_all не добавляет индексы в уже существующие таблицы, создаем недостающие явно
+        existing_indexes = {
+            index["name"]
+            for indexes in inspector.get_multi_indexes().values()
+            for index in indexes
+        }
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(engine)
+                    logger.info("Создан индекс %s", index.name)
+
+        # Заранее открываем соединения пула, чтобы первые запросы не ждали подключения
+        if is_postgres and PREWARM_POOL:
+            connections = [engine.connect() for _ in range(engine.pool.size())]
+            for conn in connections:
+                conn.close()
+            logger.info("Пул соединений прогрет: %s", len(connections))
+
+        # Проверяем наличие данных и добавляем начальные данные при необходимости.
+        # Отметка 'seeded' в app_meta - поиск по первичному ключу, независимо от размера таблиц
+        if not _BOOTSTRAPPED:
+            with get_session() as session:
+                if session.get(AppMeta, "seeded") is None:
+                    add_default_data(session)
+                    session.add(AppMeta(key="seeded", value="1"))
+                    logger.info("Начальные данные добавлены успешно")
+                else:
+                    logger.info("База данных уже содержит данные")
+            _BOOTSTRAPPED = True
+
+        # Загружаем справочники в память
+        load_caches()
 
+    except Exception as e:
+        logger.exception("Ошибка инициализации базы данных: %s", e)
+        raise
 
-        # Создаем все таблицы
-        Base.metadata.create_all(engine)
-        logger.info("Таблицы в базе данных созданы успешно")
 
-        # Проверяем наличие данных и добавляем начальные данные при необходимости
-        with get_session() as session:
-            from database.models import User
-            user_count = session.query(User).count()
-            logger.info(f"Количество пользователей в базе: {user_count}")
+# Кэш тем. Темы читаются на каждом шаге ученика, а меняются только из админ-панели,
+# поэтому держим их в памяти и сбрасываем кэш при изменении. В кэше - неизменяемые
+# кортежи (id, name, description), их безопасно разделять между потоками
+@lru_cache(maxsize=1)
+def cached_topics() -> tuple:
+    """Все темы как кортеж строк (id, name, description), упорядоченный по id"""
+    with get_session() as session:
+        rows = session.execute(select(Topic.id, Topic.name, Topic.description).order_by(Topic.id)).all()
+    return tuple(tuple(row) for row in rows)
 
-            if user_count == 0:
-                add_default_data(session)
-                logger.info("Начальные данные добавлены успешно")
-            else:
-                logger.info("База данных уже содержит данные")
 
-    except Exception as e:
-        logger.error(f"Ошибка инициализации базы данных: {e}")
-        logger.error(traceback.format_exc())
-        raise
+def load_caches():
+    """Загрузка справочных таблиц в память"""
+    cached_topics.cache_clear()
+    logger.info("Загружено тем в кэш: %s", len(cached_topics()))
+
+
+def invalidate_topic(topic_id: Optional[int] = None):
+    """Сброс кэша тем после добавления, изменения или удаления темы"""
+    # Таблица тем маленькая, при следующем обращении она перечитывается целиком
+    cached_topics.cache_clear()
+
+
+def get_cached_topics() -> List[dict]:
+    """Список всех тем из кэша"""
+    return [{"id": topic_id, "name": name, "description": description}
+            for topic_id, name, description in cached_topics()]
+
+
+def get_cached_topic(topic_id: int) -> Optional[dict]:
+    """Тема по id из кэша или None"""
+    for cached_id, name, description in cached_topics():
+        if cached_id == topic_id:
+            return {"id": cached_id, "name": name, "description": description}
+    return None
+
+
+def get_topic_names() -> Dict[int, str]:
+    """Словарь id темы -> название"""
+    return {topic_id: name for topic_id, name, _ in cached_topics()}
+
+
+def get_last_update_id() -> Optional[int]:
+    """Последний обработанный update_id, сохраненный при остановке бота"""
+    with get_session() as session:
+        return session.query(BotState.last_update_id).filter(BotState.id == 1).scalar()
+
+
+def save_last_update_id(update_id: int):
+    """Сохранение последнего обработанного update_id"""
+    with get_session() as session:
+        state = session.get(BotState, 1)
+        if state:
+            state.last_update_id = update_id
+        else:
+            session.add(BotState(id=1, last_update_id=update_id))
+
+
+def eager_user(*relationships: str) -> list:
+    """Опции selectinload для связей User (по умолчанию - все связи).
+
+    Связи загружаются одним запросом WHERE id IN (...) на всю выборку вместо
+    отдельного запроса на каждого пользователя:
+    session.query(User).options(*eager_user("children"))
+    """
+    relationships = relationships or ("results", "achievements", "children")
+    return [selectinload(getattr(User, name)) for name in relationships]
 
 
 # Улучшенный контекстный менеджер сессий
 @contextmanager
 def get_session() -> Generator[SQLAlchemySession, None, None]:
-    """Улучшенный контекстный менеджер для работы с сессией"""
-    session = Session()
-    try:
-        yield session
-        session.commit()
-        logger.debug("Сессия успешно закрыта с commit")
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Ошибка SQLAlchemy: {e}")
-        logger.error(traceback.format_exc())
-        raise
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Неожиданная ошибка в сессии: {e}")
-        logger.error(traceback.format_exc())
-        raise
-    finally:
-        # Важно: закрываем сессию в любом случае
-        session.close()
-        # Удаляем сессию из registry
-        Session.remove()
+    """Улучшенный контекстный менеджер для работы с сессией.
+
+    SessionFactory.begin() не подходит: обработчики вызывают session.commit() внутри
+    блока и продолжают работу с сессией, а begin() это запрещает. Поэтому закрытие
+    сессии выполняет ее собственный контекстный менеджер, а commit/rollback - этот.
+    """
+    with SessionFactory() as session:
+        try:
+            yield session
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if isinstance(e, SQLAlchemyError):
+                logger.exception("Ошибка SQLAlchemy: %s", e)
+            else:
+                logger.exception("Неожиданная ошибка в сессии: %s", e)
+            raise
+        # Проверка уровня дешевле вызова debug на каждой транзакции
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Сессия успешно закрыта с commit")
+
+
+@contextmanager
+def get_session_readonly() -> Generator[Connection, None, None]:
+    """Соединение в режиме autocommit для коротких запросов только на чтение.
+
+    Одиночный SELECT не требует транзакции: без BEGIN/COMMIT на запрос уходит
+    на два обмена с сервером меньше.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        yield conn
+
+
+async def run_in_session(func, *args):
+    """Выполняет синхронную функцию func(session, *args) в отдельном потоке.
+
+    Синхронный драйвер БД блокирует поток на время запроса; вынося работу с сессией
+    в поток, async-обработчик не останавливает цикл событий для остальных пользователей.
+    """
+    def call():
+        with get_session() as session:
+            return func(session, *args)
+
+    return await asyncio.to_thread(call)
+
+
+# Начальные темы, добавляются в пустую базу
+DEFAULT_TOPICS = (
+    {"name": "Древняя Русь IX-XII вв.",
+     "description": "Вопросы по истории Древней Руси в период IX-XII веков"},
+    # Добавьте другие темы по необходимости
+)
 
 
 def add_default_data(session=None):
@@ -141,40 +369,36 @@ def add_default_data(session=None):
 
     try:
         if session is None:
-            session = Session()
+            session = SessionFactory()
             should_close_session = True
 
-        from database.models import User, Topic
-
-        # Проверяем, есть ли уже администратор
-        admin_exists = session.query(User).filter(User.role == "admin").first() is not None
-
-        if not admin_exists and ADMINS:
+        # Администратор: INSERT ... ON CONFLICT DO NOTHING вместо предварительной проверки
+        if ADMINS:
             try:
                 admin_id = int(ADMINS[0])
-                admin = User(
-                    telegram_id=admin_id,
-                    username="admin",
-                    full_name="Admin",
-                    role="admin"
+                result = session.execute(
+                    dialect_insert(User)
+                    .values(telegram_id=admin_id, username="admin", full_name="Admin", role="admin")
+                    .on_conflict_do_nothing(index_elements=["telegram_id"])
                 )
-                session.add(admin)
-                logger.info(f"Default admin user added with ID: {admin_id}")
+                if result.rowcount:
+                    logger.info("Default admin user added with ID: %s", admin_id)
             except (ValueError, IndexError) as e:
-                logger.error(f"Error adding default admin: {e}")
-
-        # Проверяем, есть ли уже темы
-        topics_exist = session.query(Topic).first() is not None
-
-        if not topics_exist:
-            # Добавляем начальные темы
-            topics = [
-                Topic(name="Древняя Русь IX-XII вв.",
-                      description="Вопросы по истории Древней Руси в период IX-XII веков"),
-                # Добавьте другие темы по необходимости
-            ]
-
-            session.add_all(topics)
+                logger.error("Error adding default admin: %s", e)
+
+        # Название темы не уникально, поэтому ON CONFLICT не подходит. Темы добавляются
+        # одним INSERT ... SELECT только если таблица тем пуста
+        rows = union_all(*(
+            select(literal(topic["name"]).label("name"), literal(topic["description"]).label("description"))
+            for topic in DEFAULT_TOPICS
+        )).subquery()
+        result = session.execute(
+            insert(Topic).from_select(
+                ["name", "description"],
+                select(rows.c.name, rows.c.description).where(~exists(select(Topic.id)))
+            )
+        )
+        if result.rowcount:
             logger.info("Default topics added")
 
         if not should_close_session:
@@ -182,44 +406,57 @@ def add_default_data(session=None):
         else:
             session.commit()
 
+        # Начальные темы могли быть добавлены
+        invalidate_topic()
+
         logger.info("Default data added successfully")
 
     except Exception as e:
         if should_close_session:
             session.rollback()
-        logger.error(f"Error adding default data: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error adding default data: %s", e)
         raise
     finally:
         if should_close_session:
             session.close()
 
 
+# Время последней успешной проверки соединения и срок, в течение которого ей доверяем
+_LAST_OK_TS = 0.0
+_HEALTH_TTL = 5.0
+
+
 # Функция для проверки состояния соединения
 def check_connection() -> bool:
-    """Проверка соединения с базой данных"""
+    """Проверка соединения с базой данных (успешный результат кэшируется на _HEALTH_TTL секунд)"""
+    global _LAST_OK_TS
+    if time.monotonic() - _LAST_OK_TS < _HEALTH_TTL:
+        return True
     try:
-        with engine.connect() as conn:
-            if is_postgres:
-                conn.execute("SELECT 1")
-            else:
-                conn.execute("SELECT 1")
+        # Соединение берется из пула, pool_pre_ping отбракует мертвые.
+        # begin() завершает транзакцию при выходе, соединение не остается "idle in transaction"
+        with engine.begin() as conn:
+            conn.execute(_PING)
+        _LAST_OK_TS = time.monotonic()
         return True
     except Exception as e:
-        logger.error(f"Ошибка проверки соединения с БД: {e}")
+        logger.error("Ошибка проверки соединения с БД: %s", e)
         return False
 
 
 # Функция для восстановления соединения
 def reconnect() -> bool:
     """Попытка восстановления соединения с БД"""
+    global _LAST_OK_TS
     try:
         logger.info("Попытка восстановления соединения с БД...")
         engine.dispose()
+        # После сброса пула проверяем соединение заново, без кэша
+        _LAST_OK_TS = 0.0
         if check_connection():
             logger.info("Соединение с БД восстановлено успешно")
             return True
         return False
     except Exception as e:
-        logger.error(f"Ошибка восстановления соединения с БД: {e}")
+        logger.error("Ошибка восстановления соединения с БД: %s", e)
         return False
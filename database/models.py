@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Table
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
@@ -31,7 +31,7 @@ class User(Base):
     telegram_id = Column(Integer, unique=True, nullable=False)
     username = Column(String, nullable=True)  # Это будет telegram username
     full_name = Column(String, nullable=True)  # Это будет введенные Имя и Фамилия
-    role = Column(String, nullable=False)  # student, parent, admin
+    role = Column(String, nullable=False, index=True)  # student, parent, admin
     user_group = Column(String, nullable=True)  # Новое поле для класса ученика
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     last_active = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -58,6 +58,18 @@ class BotSettings(Base):
     value = Column(String, nullable=False)
     updated_at = Column(DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
 
+class AppMeta(Base):
+    __tablename__ = 'app_meta'
+
+    key = Column(String, primary_key=True)  # Служебные отметки, например 'seeded'
+    value = Column(String, nullable=True)
+
+class BotState(Base):
+    __tablename__ = 'bot_state'
+
+    id = Column(Integer, primary_key=True)  # Единственная строка с id=1
+    last_update_id = Column(BigInteger, nullable=True)  # Последний обработанный update_id Telegram
+
 class Topic(Base):
     __tablename__ = 'topics'
 
@@ -73,7 +85,8 @@ class Question(Base):
     __tablename__ = 'questions'
 
     id = Column(Integer, primary_key=True)
-    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False)
+    # Индекс нужен для выборки вопросов темы и подсчета их количества
+    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, index=True)
     text = Column(String, nullable=False)
     options = Column(String, nullable=False)  # JSON строка с вариантами ответов
     correct_answer = Column(String, nullable=False)  # JSON строка с правильными ответами
@@ -1,20 +1,34 @@
 import logging
 import json
-import os
 import asyncio
-import traceback
-from datetime import datetime, timezone
+import functools
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from io import BytesIO
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 
 from services.stats_service import generate_topic_analytics
-from database.models import User, Topic, Question, TestResult, Achievement, Notification
+from database.models import User, Topic, Question, TestResult, Achievement, Notification, question_result, parent_student
+from sqlalchemy import delete, insert, select, func
+from sqlalchemy.orm import selectinload, raiseload
 
-from config import ADMINS
+from config import ADMIN_IDS
 import logging
-from database.models import BotSettings
-from database.db_manager import get_session
+from database.db_manager import (
+    engine, count_queries, cached_topics, get_cached_topic, get_cached_topics, get_session, invalidate_topic,
+    run_in_session
+)
 
 # Импортируем клавиатуры
 from keyboards.admin_kb import (
@@ -27,110 +41,309 @@ from keyboards.admin_kb import (
 
 logger = logging.getLogger(__name__)
 
+# Шаблон блока проблемного вопроса; завершающий перевод строки дает пустую строку между блоками
+_PROBLEM_TMPL = (
+    "{i}. *{short}*\n"
+    "   Тема: {topic_name}\n"
+    "   Процент ошибок: {error_rate}%\n"
+    "   Всего ответов: {total_answers}\n"
+)
 
-def get_db_dialect():
-    """Определение диалекта базы данных (PostgreSQL или SQLite)"""
-    try:
-        with get_session() as session:
-            from sqlalchemy import inspect
-            connection = session.connection()
-            inspector = inspect(connection)
-            dialect_name = inspector.engine.dialect.name.lower()
-            return dialect_name
-    except Exception as e:
-        logger.error(f"Ошибка при определении диалекта базы данных: {e}")
-        # Возвращаем SQLite по умолчанию
-        return "sqlite"
-
-
-async def show_topics_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показ списка тем для редактирования"""
-    query = update.callback_query
-
-    try:
-        with get_session() as session:
-            # Получаем список тем с созданием копии данных
-            topics_data = []
-            for topic in session.query(Topic).all():
-                topics_data.append({
-                    "id": topic.id,
-                    "name": topic.name,
-                    "description": topic.description
-                })
-
-        # Форматируем текст со списком тем
-        topics_text = "✏️ *Темы для тестирования*\n\n"
-
-        if not topics_data:
-            topics_text += "Список тем пуст. Создайте первую тему."
-        else:
-            for topic in topics_data:
-                topics_text += f"• *{topic['name']}*\n"
-                if topic['description']:
-                    topics_text += f"  _{topic['description']}_\n"
-
-        # Используем готовую клавиатуру
-        reply_markup = admin_edit_topics_keyboard(topics_data)
 
-        await query.edit_message_text(
-            topics_text,
-            reply_markup=reply_markup,
-            parse_mode="Markdown"
-        )
-    except Exception as e:
-        logger.error(f"Error in show_topics_list: {e}")
-        await query.edit_message_text(
-            f"Произошла ошибка при получении списка тем: {str(e)}\n\n"
-            "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
-        )
+# Клавиатуры со списком тем строятся заново только при изменении тем: ключ кэша -
+# кортеж строк из кэша тем, после сброса кэша тем он будет другим
+@functools.lru_cache(maxsize=4)
+def _topic_picker_markup(topics: tuple) -> InlineKeyboardMarkup:
+    """Клавиатура выбора темы для нового вопроса"""
+    return admin_topics_keyboard({"id": t_id, "name": name} for t_id, name, _ in topics)
+
+
+@functools.lru_cache(maxsize=4)
+def _topics_edit_markup(topics: tuple) -> InlineKeyboardMarkup:
+    """Клавиатура списка тем для редактирования"""
+    return admin_edit_topics_keyboard([{"id": t_id, "name": name} for t_id, name, _ in topics])
+
+
+def _json_field(value) -> str:
+    """Значение для JSON-столбца вопроса: строка сохраняется как есть, остальное сериализуется"""
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _clip(text: str, limit: int = 50) -> str:
+    """Обрезка текста вопроса для списка; короткий текст возвращается без копирования"""
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}..."
+
+
+# Инструкция по формату файла импорта: общая часть и окончания для команды /import и кнопки
+_IMPORT_FORMAT_TEXT = (
+    "Для импорта вопросов отправьте JSON файл с вопросами.\n\n"
+    "Структура файла должна соответствовать формату:\n"
+    "```\n"
+    "{\n"
+    '  "topic": {\n'
+    '    "id": 1,\n'
+    '    "name": "Название темы",\n'
+    '    "description": "Описание темы"\n'
+    "  },\n"
+    '  "questions": [\n'
+    "    {\n"
+    '      "id": 1,\n'
+    '      "text": "Текст вопроса",\n'
+    '      "options": ["Вариант 1", "Вариант 2", ...],\n'
+    '      "correct_answer": [0],\n'
+    '      "question_type": "single",\n'
+    '      "difficulty": 1,\n'
+    '      "explanation": "Объяснение ответа"\n'
+    "    },\n"
+    "    ...\n"
+    "  ]\n"
+    "}\n"
+    "```\n\n"
+)
+_IMPORT_HELP_TEXT = _IMPORT_FORMAT_TEXT + "Или просто используйте команду /admin и выберите 'Импорт вопросов'."
+_IMPORT_BUTTON_HELP_TEXT = _IMPORT_FORMAT_TEXT + "Отправьте файл как документ в этот чат."
+
+# Готовый график динамики результатов: час -> (время построения, PNG, текст сводки).
+# Данные меняются медленнее, чем администраторы открывают отчет
+_DYNAMICS_TTL = 300
+_dynamics_cache = {}
+
+# Фигура графика динамики создается один раз и перерисовывается при каждом построении.
+# Рисуем через Agg напрямую, без pyplot: нет глобального состояния и утечек фигур
+_dynamics_fig = Figure(figsize=(10, 6))
+FigureCanvasAgg(_dynamics_fig)
+_dynamics_ax = _dynamics_fig.add_subplot(111)
+# Фигура одна на процесс, поэтому одновременно строится не больше одного графика
+_dynamics_lock = threading.Lock()
+
+# Неизменяемые клавиатуры создаются один раз при загрузке модуля
+_EXPORT_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📊 Результаты тестов", callback_data="admin_export_results"),
+        InlineKeyboardButton("📈 Статистика по темам", callback_data="admin_export_topics")
+    ],
+    [
+        InlineKeyboardButton("👨‍🎓 Прогресс учеников", callback_data="admin_export_students"),
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+    ]
+])
+_NO_PROBLEM_DATA_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_topic_stats")]
+])
+_DYNAMICS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Обновить", callback_data="admin_refresh_dynamics")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")]
+])
+_PROBLEM_QUESTIONS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Детальный анализ", callback_data="admin_question_analysis")],
+    [InlineKeyboardButton("🔙 Назад к статистике", callback_data="admin_topic_stats")]
+])
+_RESULTS_PERIOD_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("За неделю", callback_data="admin_export_results_week"),
+        InlineKeyboardButton("За месяц", callback_data="admin_export_results_month")
+    ],
+    [
+        InlineKeyboardButton("За год", callback_data="admin_export_results_year"),
+        InlineKeyboardButton("За всё время", callback_data="admin_export_results_all")
+    ],
+    [
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+    ]
+])
+_BACK_MAIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")]
+])
+_BACK_PROBLEMATIC_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_problematic_questions")]
+])
+_QUESTION_ANALYSIS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад к проблемным вопросам", callback_data="admin_problematic_questions")]
+])
+_BACK_SETTINGS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")]
+])
+_SETTINGS_ERROR_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")]
+])
+_QUESTION_ADDED_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("➕ Добавить еще вопрос", callback_data="admin_add_question"),
+        InlineKeyboardButton("🔙 Вернуться в меню", callback_data="admin_back_main")
+    ]
+])
+
+
+# Отдельный пул потоков для статистики и экспорта: тяжелые отчеты не занимают цикл событий
+# и не вытесняют остальные задачи из пула по умолчанию
+_REPORTS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="reports")
+# Выгрузки в Excel самые тяжелые: одновременно строится не больше двух,
+# чтобы статистике всегда оставались свободные потоки пула
+_EXPORT_SLOTS = asyncio.Semaphore(2)
+
+
+async def _run_report(func, *args, **kwargs):
+    """Выполнение синхронной функции отчета в пуле _REPORTS_EXECUTOR"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_REPORTS_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+def _weighted_mean(values, weights) -> float:
+    """Среднее значение values с весами weights"""
+    return sum(v * w for v, w in zip(values, weights)) / sum(weights)
+
+
+# Начиная с этого числа вопросов темы агрегируются векторно через numpy
+_NUMPY_AGGREGATE_MIN = 1000
+
+
+def _aggregate_topics_np(questions) -> list:
+    """Векторный вариант _aggregate_topics для больших выборок"""
+    topic_ids = np.fromiter((q["topic_id"] for q in questions), dtype=np.int64, count=len(questions))
+    error_rates = np.fromiter((q["error_rate"] for q in questions), dtype=np.float64, count=len(questions))
+    names = {q["topic_id"]: q["topic_name"] for q in questions}
+
+    # Номера тем переводим в сплошной диапазон 0..K-1 для bincount
+    unique_ids, inverse = np.unique(topic_ids, return_inverse=True)
+    counts = np.bincount(inverse)
+    averages = np.bincount(inverse, weights=error_rates) / counts
+    order = np.argsort(-averages, kind="stable")
+
+    return [(names[int(unique_ids[i])], float(averages[i]), int(counts[i])) for i in order]
+
+
+def _aggregate_topics(questions) -> list:
+    """Средний процент ошибок по темам: [(название, средний процент, число вопросов)] по убыванию"""
+    if len(questions) >= _NUMPY_AGGREGATE_MIN:
+        return _aggregate_topics_np(questions)
+
+    # Группируем вопросы по темам за один проход: [сумма процентов ошибок, число вопросов, название]
+    topic_sums = defaultdict(lambda: [0.0, 0, ""])
+    for question in questions:
+        topic_sum = topic_sums[question["topic_id"]]
+        topic_sum[0] += question["error_rate"]
+        topic_sum[1] += 1
+        topic_sum[2] = question["topic_name"]
+
+    topics = [(name, error_sum / count, count) for error_sum, count, name in topic_sums.values()]
+    topics.sort(key=lambda t: t[1], reverse=True)
+    return topics
+
+
+def _render_dynamics_png(dates, values) -> bytes:
+    """Построение графика динамики в PNG. Выполняется в отдельном потоке"""
+    with _dynamics_lock:
+        ax = _dynamics_ax
+        ax.clear()
+        ax.plot(dates, values, marker='o', linestyle='-')
+
+        ax.set_title("Динамика результатов тестирования за последний месяц")
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Средний процент")
+        ax.grid(True)
+        ax.tick_params(axis="x", labelrotation=45)
+        _dynamics_fig.tight_layout()
+
+        # 80 dpi достаточно для просмотра в Telegram, а PNG заметно меньше
+        img_buf = BytesIO()
+        _dynamics_fig.savefig(img_buf, format='png', dpi=80)
+    return img_buf.getvalue()
+
+
+async def require_admin(update: Update, denial_text: str) -> bool:
+    """Проверка прав администратора; при отказе отвечает пользователю текстом denial_text"""
+    if update.effective_user.id in ADMIN_IDS:
+        return True
 
-def get_setting(key: str, default=None):
-    """Получение настройки по ключу"""
-    try:
-        with get_session() as session:
-            setting = session.query(BotSettings).filter(BotSettings.key == key).first()
-            if setting:
-                return setting.value
-            return default
-    except Exception as e:
-        logger.error(f"Ошибка при получении настройки {key}: {e}")
-        return default
-
-
-def set_setting(key: str, value):
-    """Установка настройки"""
-    try:
-        with get_session() as session:
-            setting = session.query(BotSettings).filter(BotSettings.key == key).first()
-            if setting:
-                setting.value = str(value)
-            else:
-                setting = BotSettings(key=key, value=str(value))
-                session.add(setting)
-            session.commit()
-            return True
-    except Exception as e:
-        logger.error(f"Ошибка при установке настройки {key}: {e}")
-        return False
-
-
-def get_quiz_settings():
-    """Получение настроек теста"""
-    questions_count = int(get_setting("default_questions_count", "10"))
-
-    # Определение времени в зависимости от количества вопросов
-    if questions_count <= 10:
-        time_limit = 5 * 60  # 5 минут в секундах
-    elif questions_count <= 15:
-        time_limit = 10 * 60  # 10 минут в секундах
+    if update.callback_query:
+        await update.callback_query.edit_message_text(denial_text)
     else:
-        time_limit = 20 * 60  # 20 минут в секундах
+        await update.message.reply_text(denial_text)
+    return False
+
+
+# Диалект не меняется за время работы процесса - определяем его один раз по движку
+_DIALECT_CACHE = engine.dialect.name.lower()
+
+
+def get_db_dialect():
+    """Определение диалекта базы данных (PostgreSQL или SQLite)"""
+    return _DIALECT_CACHE
+
+
+# Синхронные операции с темами: вызываются через run_in_session в отдельном потоке,
+# чтобы запросы к базе не останавливали цикл событий
+def _topic_delete_info(session, topic_id: int):
+    """Имя темы и количество ее вопросов одним запросом; None, если темы нет"""
+    return session.execute(
+        select(Topic.name, func.count(Question.id))
+        .outerjoin(Question, Question.topic_id == Topic.id)
+        .where(Topic.id == topic_id)
+        .group_by(Topic.id, Topic.name)
+    ).first()
+
+
+def _delete_topic_rows(session, topic_id: int):
+    """Удаление темы вместе с вопросами; возвращает имя удаленной темы или None"""
+    # Два DELETE в одной транзакции без предварительной загрузки темы:
+    # сначала вопросы темы, затем сама тема, имя которой возвращает DELETE
+    session.execute(delete(Question).where(Question.topic_id == topic_id))
+    topic_delete = delete(Topic).where(Topic.id == topic_id)
+    if engine.dialect.delete_returning:
+        return session.execute(topic_delete.returning(Topic.name)).scalar()
+    # SQLite старше 3.35 не поддерживает RETURNING
+    topic_name = session.scalar(select(Topic.name).where(Topic.id == topic_id))
+    session.execute(topic_delete)
+    return topic_name
+
+
+def _rename_topic(session, topic_id: int, new_name: str):
+    """Переименование темы; возвращает прежнее название или None, если темы нет"""
+    topic = session.get(Topic, topic_id)
+    if not topic:
+        return None
+    old_name = topic.name
+    topic.name = new_name
+    return old_name
+
+
+def _set_topic_description(session, topic_id: int, description: str):
+    """Изменение описания темы; возвращает название темы или None, если темы нет"""
+    topic = session.get(Topic, topic_id)
+    if not topic:
+        return None
+    topic.description = description
+    return topic.name
+
+
+def _delete_user_core(session, user_id: int, user_type: str) -> None:
+    """Удаление пользователя и связанных данных набором DELETE в порядке внешних ключей.
+
+    Запросы выполняются без ORM: объекты не загружаются, каскады unit of work не обходятся.
+    """
+    if user_type == "student":
+        # Сначала записи промежуточной таблицы 'question_result' по результатам тестов пользователя
+        session.execute(
+            question_result.delete().where(
+                question_result.c.test_result_id.in_(
+                    select(TestResult.id).where(TestResult.user_id == user_id)
+                )
+            )
+        )
+        # Теперь можно безопасно удалить результаты тестов и достижения
+        session.execute(TestResult.__table__.delete().where(TestResult.user_id == user_id))
+        session.execute(Achievement.__table__.delete().where(Achievement.user_id == user_id))
+        # Связи с родителями
+        session.execute(parent_student.delete().where(parent_student.c.student_id == user_id))
+    elif user_type == "parent":
+        # Связи с детьми; сами ученики и их данные не затрагиваются
+        session.execute(parent_student.delete().where(parent_student.c.parent_id == user_id))
 
-    return {
-        "questions_count": questions_count,
-        "time_limit": time_limit,
-        "time_minutes": time_limit // 60
-    }
+    # Уведомления и сам пользователь
+    session.execute(Notification.__table__.delete().where(Notification.user_id == user_id))
+    session.execute(User.__table__.delete().where(User.id == user_id))
 
 
 class AdminHandler:
@@ -140,6 +353,53 @@ class AdminHandler:
         self.quiz_service = None
         self.parent_service = None
 
+        # Таблицы диспетчеризации кнопок панели администратора:
+        # точные значения callback_data ищутся по словарю
+        self._exact_handlers = {
+            "admin_problematic_questions": self.show_problematic_questions,
+            "admin_results_dynamics": self.show_results_dynamics,
+            "admin_refresh_dynamics": self._refresh_dynamics,
+            "admin_export": self._show_export_menu,
+            "admin_topic_stats": self.show_topic_stats,
+            "admin_users": self.show_users_list,
+            "admin_edit_topics": self.show_topics_list,
+            "admin_add_question": self._start_add_question,
+            "admin_import": self._show_import_help,
+            "admin_back_topics_list": self.show_topics_list,
+            "admin_settings": self.show_bot_settings,
+            "admin_setting_questions_count": self._show_questions_count_setting,
+            "admin_setting_reports": self._show_reports_setting,
+            "admin_question_analysis": self.show_question_analysis,
+            "admin_back_main": self.show_admin_panel,
+            "admin_back_topics": self._choose_question_topic,
+            "admin_add_topic": self._start_add_topic,
+            "admin_list_students": self.show_students_list,
+            "admin_list_parents": self.show_parents_list,
+        }
+        # Кнопки вида "<действие>_<число>": действие ищется по словарю, число передается обработчику
+        self._id_handlers = {
+            "admin_edit_topics": self._open_topic,
+            "admin_edit_topic_name": self._edit_topic_name,
+            "admin_edit_topic_desc": self._edit_topic_desc,
+            "admin_delete_topic": self._delete_topic,
+            "admin_set_questions": self._set_questions_count,
+            "admin_select_topic": self._select_topic,
+            "admin_edit_topic": self._edit_topic,
+            "admin_confirm_delete_topic": self._confirm_delete_topic,
+            "admin_view_student": self._view_student,
+            "admin_view_parent": self._view_parent,
+            "admin_delete_student": self._delete_student,
+            "admin_delete_parent": self._delete_parent,
+            "admin_confirm_delete_student": self._confirm_delete_student,
+            "admin_confirm_delete_parent": self._confirm_delete_parent,
+        }
+        # Остальные кнопки с параметром проверяются по префиксу
+        self._prefix_handlers = (
+            ("admin_export_", self._export),
+            ("admin_reports_", self._reports),
+            ("admin_question_type_", self._set_question_type),
+        )
+
     def init_services(self, quiz_service_inst=None, parent_service_inst=None):
         """Инициализация сервисов в классе"""
         if quiz_service_inst:
@@ -152,88 +412,51 @@ class AdminHandler:
         """Общая логика обработки действий редактирования темы"""
         query = update.callback_query
 
-        with get_session() as session:
-            topic = session.query(Topic).get(topic_id)
-            if not topic:
-                await query.edit_message_text("Тема не найдена.")
-                return False
-
-            # Сохраняем необходимые данные из темы, пока сессия активна
-            topic_name = topic.name
-            topic_description = topic.description
-
-            # Обрабатываем разные типы действий
-            if action_type == "name":
-                await query.edit_message_text(
-                    f"Введите новое название для темы '{topic_name}':\n\n"
-                    "Отправьте текст в следующем сообщении."
-                )
-
-                # Устанавливаем состояние
-                context.user_data["admin_state"] = "editing_topic_name"
-                context.user_data["editing_topic_id"] = topic_id
-                logger.info(f"Установлено состояние editing_topic_name для темы {topic_id}")
-
-            elif action_type == "desc":
-                await query.edit_message_text(
-                    f"Введите новое описание для темы '{topic_name}':\n\n"
-                    f"Текущее описание: {topic_description or 'Нет описания'}\n\n"
-                    "Отправьте текст в следующем сообщении."
-                )
+        # Тема берется из кэша тем, без запроса к базе
+        topic = get_cached_topic(topic_id)
+        if not topic:
+            await query.edit_message_text("Тема не найдена.")
+            return False
 
-                # Устанавливаем состояние
-                context.user_data["admin_state"] = "editing_topic_description"
-                context.user_data["editing_topic_id"] = topic_id
-                logger.info(f"Установлено состояние editing_topic_description для темы {topic_id}")
+        # Обрабатываем разные типы действий
+        if action_type == "name":
+            await query.edit_message_text(
+                f"Введите новое название для темы '{topic['name']}':\n\n"
+                "Отправьте текст в следующем сообщении."
+            )
 
-            elif action_type == "delete":
-                # Проверяем, есть ли вопросы, связанные с этой темой
-                questions_count = session.query(Question).filter(Question.topic_id == topic_id).count()
+            # Устанавливаем состояние
+            context.user_data["admin_state"] = "editing_topic_name"
+            context.user_data["editing_topic_id"] = topic_id
+            logger.info(f"Установлено состояние editing_topic_name для темы {topic_id}")
 
-                warning_text = ""
-                if questions_count > 0:
-                    warning_text = f"\n⚠️ ВНИМАНИЕ! К этой теме привязано {questions_count} вопросов. При удалении темы все связанные вопросы также будут удалены."
+        elif action_type == "desc":
+            await query.edit_message_text(
+                f"Введите новое описание для темы '{topic['name']}':\n\n"
+                f"Текущее описание: {topic['description'] or 'Нет описания'}\n\n"
+                "Отправьте текст в следующем сообщении."
+            )
 
-                # Используем готовую клавиатуру для подтверждения
-                reply_markup = admin_confirm_delete_keyboard(topic_id)
+            # Устанавливаем состояние
+            context.user_data["admin_state"] = "editing_topic_description"
+            context.user_data["editing_topic_id"] = topic_id
+            logger.info(f"Установлено состояние editing_topic_description для темы {topic_id}")
 
-                await query.edit_message_text(
-                    f"Вы уверены, что хотите удалить тему '{topic_name}'?{warning_text}",
-                    reply_markup=reply_markup
-                )
-            else:
-                return False
+        else:
+            return False
 
         return True
 
     async def export_to_excel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /export_excel для экспорта данных в Excel"""
-        user_id = update.effective_user.id
-
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await update.message.reply_text(
-                "У вас нет прав для экспорта данных."
-            )
+        if not await require_admin(update, "У вас нет прав для экспорта данных."):
             return
 
         # Показываем меню выбора типа экспорта
-        keyboard = [
-            [
-                InlineKeyboardButton("📊 Результаты тестов", callback_data="admin_export_results"),
-                InlineKeyboardButton("📈 Статистика по темам", callback_data="admin_export_topics")
-            ],
-            [
-                InlineKeyboardButton("👨‍🎓 Прогресс учеников", callback_data="admin_export_students"),
-                InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-            ]
-        ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await update.message.reply_text(
             "Выберите тип данных для экспорта:",
-            reply_markup=reply_markup
+            reply_markup=_EXPORT_MENU_MARKUP
         )
 
     async def show_problematic_questions(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -242,16 +465,13 @@ class AdminHandler:
         user_id = update.effective_user.id
 
         # Проверка прав администратора
-        if str(user_id) not in ADMINS:
-            await query.edit_message_text(
-                "У вас нет прав для доступа к этой информации."
-            )
+        if not await require_admin(update, "У вас нет прав для доступа к этой информации."):
             return
 
         try:
             # Получаем статистику проблемных вопросов
             from services.stats_service import get_problematic_questions
-            result = get_problematic_questions(limit=10)
+            result = await _run_report(get_problematic_questions, limit=10)
 
             if not result["success"]:
                 await query.edit_message_text(
@@ -260,40 +480,28 @@ class AdminHandler:
                 return
 
             if not result.get("has_data", False):
-                # Создаем клавиатуру для возврата
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_topic_stats")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-
                 await query.edit_message_text(
                     "Нет данных о проблемных вопросах. Возможно, еще не было пройдено достаточно тестов.",
-                    reply_markup=reply_markup
+                    reply_markup=_NO_PROBLEM_DATA_MARKUP
                 )
                 return
 
             # Формируем текст с проблемными вопросами
             problematic_questions = result["problematic_questions"]
 
-            text = "🔴 *Самые проблемные вопросы*\n\n"
+            # Собираем строки в список и склеиваем один раз
+            parts = ["🔴 *Самые проблемные вопросы*", ""]
 
             for i, question in enumerate(problematic_questions, 1):
-                short_question = question["question_text"][:50] + "..." if len(question["question_text"]) > 50 else \
-                    question["question_text"]
-                text += f"{i}. *{short_question}*\n"
-                text += f"   Тема: {question['topic_name']}\n"
-                text += f"   Процент ошибок: {question['error_rate']}%\n"
-                text += f"   Всего ответов: {question['total_answers']}\n\n"
-
-            # Создаем клавиатуру для возврата и просмотра детальной информации
-            keyboard = [
-                [InlineKeyboardButton("📊 Детальный анализ", callback_data="admin_question_analysis")],
-                [InlineKeyboardButton("🔙 Назад к статистике", callback_data="admin_topic_stats")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+                short = _clip(question["question_text"])
+                parts.append(_PROBLEM_TMPL.format_map({**question, "i": i, "short": short}))
+
+            text = "\n".join(parts)
 
             # Отправляем сообщение с текстом
             await query.edit_message_text(
                 text,
-                reply_markup=reply_markup,
+                reply_markup=_PROBLEM_QUESTIONS_MARKUP,
                 parse_mode="Markdown"
             )
 
@@ -306,21 +514,15 @@ class AdminHandler:
                 )
 
         except Exception as e:
-            logger.error(f"Error in show_problematic_questions: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_problematic_questions: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении статистики проблемных вопросов: {str(e)}"
             )
 
     async def admin_panel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /admin для открытия панели администратора"""
-        user_id = update.effective_user.id
-
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await update.message.reply_text(
-                "У вас нет прав для доступа к панели администратора."
-            )
+        if not await require_admin(update, "У вас нет прав для доступа к панели администратора."):
             return
 
         # Используем готовую клавиатуру
@@ -333,26 +535,19 @@ class AdminHandler:
             parse_mode="Markdown"
         )
 
-    async def show_topics_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Показ списка тем для редактирования"""
+    @count_queries(max_queries=1)
+    async def show_topics_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               notice: str = "") -> None:
+        """Показ списка тем для редактирования; notice - строка результата операции над списком"""
         query = update.callback_query
 
         try:
-            with get_session() as session:
-                # ВАЖНО: Создаем копии данных, пока сессия активна
-                topics_data = []
-                for topic in session.query(Topic).all():
-                    # Копируем все необходимые данные
-                    topics_data.append({
-                        "id": topic.id,
-                        "name": topic.name,
-                        "description": topic.description,
-                        # Добавляем другие поля если нужно
-                    })
-                # Сессия закроется автоматически при выходе из with блока
+            # Темы берем из кэша: он сбрасывается при каждом изменении тем
+            topics_data = get_cached_topics()
 
             # Форматируем текст со списком тем
-            topics_text = "✏️ *Темы для тестирования*\n\n"
+            topics_text = f"{notice}\n\n" if notice else ""
+            topics_text += "✏️ *Темы для тестирования*\n\n"
 
             if not topics_data:
                 topics_text += "Список тем пуст. Создайте первую тему."
@@ -363,7 +558,7 @@ class AdminHandler:
                         topics_text += f"  _{topic['description']}_\n"
 
             # Используем готовую клавиатуру
-            reply_markup = admin_edit_topics_keyboard(topics_data)
+            reply_markup = _topics_edit_markup(cached_topics())
 
             await query.edit_message_text(
                 topics_text,
@@ -371,8 +566,7 @@ class AdminHandler:
                 parse_mode="Markdown"
             )
         except Exception as e:
-            logger.error(f"Error in show_topics_list: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_topics_list: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении списка тем: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
@@ -380,20 +574,12 @@ class AdminHandler:
 
     async def add_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /add_question для добавления нового вопроса"""
-        user_id = update.effective_user.id
-
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await update.message.reply_text(
-                "У вас нет прав для добавления вопросов."
-            )
+        if not await require_admin(update, "У вас нет прав для добавления вопросов."):
             return
 
         # Получаем список тем для выбора
-        with get_session() as session:
-            topics = session.query(Topic).all()
-            # Преобразуем объекты в словари для передачи в функцию клавиатуры
-            topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
+        topics = cached_topics()
 
         if not topics:
             await update.message.reply_text(
@@ -402,7 +588,7 @@ class AdminHandler:
             return
 
         # Используем готовую клавиатуру
-        reply_markup = admin_topics_keyboard(topics_data)
+        reply_markup = _topic_picker_markup(topics)
 
         await update.message.reply_text(
             "Выберите тему для нового вопроса:",
@@ -412,15 +598,21 @@ class AdminHandler:
         # Устанавливаем состояние для пользователя
         context.user_data["admin_state"] = "adding_question"
 
+    @count_queries(max_queries=3)
     async def show_student_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE, student_id: int) -> None:
         """Показ подробной информации об ученике"""
         query = update.callback_query
 
         try:
             with get_session() as session:
-                student = session.query(User).get(student_id)
-
-                if not student or student.role != "student":
+                # Родителей загружаем одним дополнительным запросом, прочие связи запрещены
+                student = session.execute(
+                    select(User)
+                    .options(selectinload(User.parents), raiseload("*"))
+                    .where(User.id == student_id, User.role == "student")
+                ).scalar_one_or_none()
+
+                if student is None:
                     await query.edit_message_text("Ученик не найден.")
                     return
 
@@ -430,11 +622,15 @@ class AdminHandler:
                 created_at = student.created_at.strftime('%d.%m.%Y %H:%M') if student.created_at else "Неизвестно"
                 last_active = student.last_active.strftime('%d.%m.%Y %H:%M') if student.last_active else "Никогда"
 
-                # Статистика тестов
-                test_count = session.query(TestResult).filter(TestResult.user_id == student.id).count()
-
-                # Достижения
-                achievements_count = session.query(Achievement).filter(Achievement.user_id == student.id).count()
+                # Количество тестов и достижений одним запросом
+                test_count, achievements_count = session.execute(
+                    select(
+                        select(func.count(TestResult.id))
+                        .where(TestResult.user_id == student.id).scalar_subquery(),
+                        select(func.count(Achievement.id))
+                        .where(Achievement.user_id == student.id).scalar_subquery()
+                    )
+                ).one()
 
                 # Связанные родители
                 parents = []
@@ -442,23 +638,26 @@ class AdminHandler:
                     parent_name = parent.full_name or parent.username or f"Родитель {parent.id}"
                     parents.append(parent_name)
 
-                # Формируем текст
-                details_text = f"📋 *Информация об ученике*\n\n"
-                details_text += f"*Имя:* {name}\n"
-                details_text += f"*Telegram ID:* {telegram_id}\n"
-                details_text += f"*Дата регистрации:* {created_at}\n"
-                details_text += f"*Последняя активность:* {last_active}\n\n"
-
-                details_text += f"*Статистика:*\n"
-                details_text += f"• Пройдено тестов: {test_count}\n"
-                details_text += f"• Достижений: {achievements_count}\n\n"
-
-                details_text += f"*Связанные родители ({len(parents)}):*\n"
+                # Формируем текст: строки собираем в список и склеиваем один раз
+                parts = [
+                    "📋 *Информация об ученике*",
+                    "",
+                    f"*Имя:* {name}",
+                    f"*Telegram ID:* {telegram_id}",
+                    f"*Дата регистрации:* {created_at}",
+                    f"*Последняя активность:* {last_active}",
+                    "",
+                    "*Статистика:*",
+                    f"• Пройдено тестов: {test_count}",
+                    f"• Достижений: {achievements_count}",
+                    "",
+                    f"*Связанные родители ({len(parents)}):*"
+                ]
                 if parents:
-                    for parent_name in parents:
-                        details_text += f"• {parent_name}\n"
+                    parts.extend(f"• {parent_name}" for parent_name in parents)
                 else:
-                    details_text += "Нет связанных родителей\n"
+                    parts.append("Нет связанных родителей")
+                details_text = "\n".join(parts)
 
                 # Создаем клавиатуру для действий с учеником
                 reply_markup = admin_student_actions_keyboard(student_id)
@@ -469,22 +668,27 @@ class AdminHandler:
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            logger.error(f"Error in show_student_details: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_student_details: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении информации об ученике: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
             )
 
+    @count_queries(max_queries=2)
     async def show_parent_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE, parent_id: int) -> None:
         """Показ подробной информации о родителе"""
         query = update.callback_query
 
         try:
             with get_session() as session:
-                parent = session.query(User).get(parent_id)
-
-                if not parent or parent.role != "parent":
+                # Детей загружаем одним дополнительным запросом, прочие связи запрещены
+                parent = session.execute(
+                    select(User)
+                    .options(selectinload(User.children), raiseload("*"))
+                    .where(User.id == parent_id, User.role == "parent")
+                ).scalar_one_or_none()
+
+                if parent is None:
                     await query.edit_message_text("Родитель не найден.")
                     return
 
@@ -508,19 +712,22 @@ class AdminHandler:
                     child_name = child.full_name or child.username or f"Ученик {child.id}"
                     children.append((child.id, child_name))
 
-                # Формируем текст
-                details_text = f"📋 *Информация о родителе*\n\n"
-                details_text += f"*Имя:* {name}\n"
-                details_text += f"*Telegram ID:* {telegram_id}\n"
-                details_text += f"*Дата регистрации:* {created_at}\n"
-                details_text += f"*Последняя активность:* {last_active}\n\n"
-
-                details_text += f"*Связанные ученики ({len(children)}):*\n"
+                # Формируем текст: строки собираем в список и склеиваем один раз
+                parts = [
+                    "📋 *Информация о родителе*",
+                    "",
+                    f"*Имя:* {name}",
+                    f"*Telegram ID:* {telegram_id}",
+                    f"*Дата регистрации:* {created_at}",
+                    f"*Последняя активность:* {last_active}",
+                    "",
+                    f"*Связанные ученики ({len(children)}):*"
+                ]
                 if children:
-                    for _, child_name in children:
-                        details_text += f"• {child_name}\n"
+                    parts.extend(f"• {child_name}" for _, child_name in children)
                 else:
-                    details_text += "Нет связанных учеников\n"
+                    parts.append("Нет связанных учеников")
+                details_text = "\n".join(parts)
 
                 # Создаем клавиатуру для действий с родителем
                 reply_markup = admin_parent_actions_keyboard(parent_id)
@@ -531,13 +738,13 @@ class AdminHandler:
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            logger.error(f"Error in show_parent_details: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_parent_details: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении информации о родителе: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
             )
 
+    @count_queries(max_queries=4)
     async def confirm_delete_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int,
                                   user_type: str) -> None:
         """Подтверждение удаления пользователя"""
@@ -545,7 +752,8 @@ class AdminHandler:
 
         try:
             with get_session() as session:
-                user = session.query(User).get(user_id)
+                # Связанные данные только подсчитываются, загрузка связей не нужна
+                user = session.get(User, user_id, options=[raiseload("*")])
 
                 if not user:
                     await query.edit_message_text("Пользователь не найден.")
@@ -556,33 +764,39 @@ class AdminHandler:
                 # Определение текста в зависимости от типа пользователя
                 user_type_text = "ученика" if user_type == "student" else "родителя"
 
-                # Предупреждения в зависимости от типа пользователя
-                warning_text = ""
+                # Строки сообщения: вопрос, предупреждения в зависимости от типа пользователя, итог
+                parts = [f"❓ Вы действительно хотите удалить {user_type_text} *{name}*?"]
                 if user_type == "student":
-                    # Для ученика проверяем связанные данные
-                    test_count = session.query(TestResult).filter(TestResult.user_id == user.id).count()
-                    achievements_count = session.query(Achievement).filter(Achievement.user_id == user.id).count()
-                    parents_count = len(user.parents)
+                    # Для ученика проверяем связанные данные - только счетчики, без загрузки объектов
+                    test_count = session.scalar(
+                        select(func.count(TestResult.id)).where(TestResult.user_id == user.id))
+                    achievements_count = session.scalar(
+                        select(func.count(Achievement.id)).where(Achievement.user_id == user.id))
+                    parents_count = session.scalar(
+                        select(func.count()).select_from(parent_student)
+                        .where(parent_student.c.student_id == user.id))
 
                     if test_count > 0 or achievements_count > 0 or parents_count > 0:
-                        warning_text += "\n\n⚠️ При удалении ученика будут также удалены:\n"
+                        parts.extend(("", "⚠️ При удалении ученика будут также удалены:"))
                         if test_count > 0:
-                            warning_text += f"• Результаты {test_count} тестов\n"
+                            parts.append(f"• Результаты {test_count} тестов")
                         if achievements_count > 0:
-                            warning_text += f"• {achievements_count} достижений\n"
+                            parts.append(f"• {achievements_count} достижений")
                         if parents_count > 0:
-                            warning_text += f"• Связи с {parents_count} родителями\n"
+                            parts.append(f"• Связи с {parents_count} родителями")
 
                 elif user_type == "parent":
                     # Для родителя проверяем связанных учеников
-                    children_count = len(user.children)
+                    children_count = session.scalar(
+                        select(func.count()).select_from(parent_student)
+                        .where(parent_student.c.parent_id == user.id))
 
                     if children_count > 0:
-                        warning_text += "\n\n⚠️ При удалении родителя будут удалены связи с учениками. Сами ученики и их данные не будут затронуты."
+                        parts.extend(("", "⚠️ При удалении родителя будут удалены связи с учениками. Сами ученики и их данные не будут затронуты."))
 
                 # Формируем сообщение
-                confirm_text = f"❓ Вы действительно хотите удалить {user_type_text} *{name}*?{warning_text}\n\n"
-                confirm_text += "Это действие нельзя отменить."
+                parts.extend(("", "Это действие нельзя отменить."))
+                confirm_text = "\n".join(parts)
 
                 # Клавиатура для подтверждения
                 reply_markup = admin_confirm_delete_user_keyboard(user_id, user_type)
@@ -593,8 +807,7 @@ class AdminHandler:
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            logger.error(f"Error in confirm_delete_user: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in confirm_delete_user: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при подготовке к удалению пользователя: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
@@ -610,7 +823,9 @@ class AdminHandler:
             success = False
 
             with get_session() as session:
-                user = session.query(User).get(user_id)
+                user = session.execute(
+                    select(User.id, User.full_name, User.username).where(User.id == user_id)
+                ).one_or_none()
                 if not user:
                     await query.edit_message_text("Пользователь не найден.")
                     return
@@ -618,78 +833,27 @@ class AdminHandler:
                 # Сохраняем имя пользователя перед удалением
                 user_name = user.full_name or user.username or f"Пользователь {user.id}"
 
-                # Удаляем связанные данные в зависимости от типа пользователя
-                if user_type == "student":
-                    # Получаем все ID результатов тестов пользователя
-                    test_result_ids = [r.id for r in
-                                       session.query(TestResult).filter(TestResult.user_id == user.id).all()]
-
-                    # Сначала удаляем записи из промежуточной таблицы 'question_result'
-                    if test_result_ids:
-                        # Используем прямой SQL запрос, так как таблица определена как Table, а не класс
-                        from sqlalchemy import text
-                        for test_id in test_result_ids:
-                            session.execute(
-                                text("DELETE FROM question_result WHERE test_result_id = :test_id"),
-                                {"test_id": test_id}
-                            )
-                        # Или удаляем одним запросом
-                        # placeholders = ','.join([':id'+str(i) for i in range(len(test_result_ids))])
-                        # params = {f'id{i}': id_val for i, id_val in enumerate(test_result_ids)}
-                        # session.execute(
-                        #     text(f"DELETE FROM question_result WHERE test_result_id IN ({placeholders})"),
-                        #     params
-                        # )
-
-                    # Теперь можно безопасно удалить результаты тестов
-                    session.query(TestResult).filter(TestResult.user_id == user.id).delete()
-
-                    # Удаляем достижения
-                    session.query(Achievement).filter(Achievement.user_id == user.id).delete()
-
-                    # Удаляем уведомления
-                    session.query(Notification).filter(Notification.user_id == user.id).delete()
-
-                    # Явно отвязываем родителей для решения проблем с foreign key
-                    for parent in user.parents:
-                        parent.children.remove(user)
-
-                elif user_type == "parent":
-                    # Удаляем уведомления
-                    session.query(Notification).filter(Notification.user_id == user.id).delete()
-
-                    # Явно отвязываем детей
-                    user.children = []
-
-                # Применяем изменения до удаления пользователя
-                session.flush()
-
-                # Удаляем самого пользователя
-                session.delete(user)
+                # Удаляем пользователя и связанные данные в одной транзакции
+                _delete_user_core(session, user_id, user_type)
                 session.commit()
                 success = True
 
             if success and user_name:
                 user_type_text = "Ученик" if user_type == "student" else "Родитель"
-                await query.edit_message_text(
-                    f"✅ {user_type_text} *{user_name}* успешно удален вместе со всеми связанными данными.",
-                    parse_mode="Markdown"
-                )
+                notice = f"✅ {user_type_text} *{user_name}* успешно удален вместе со всеми связанными данными."
 
-                # Возвращаемся к соответствующему списку после небольшой паузы
-                await asyncio.sleep(2)
+                # Возвращаемся к соответствующему списку, сообщение об удалении остается над ним
                 if user_type == "student":
-                    await self.show_students_list(update, context)
+                    await self.show_students_list(update, context, notice)
                 else:
-                    await self.show_parents_list(update, context)
+                    await self.show_parents_list(update, context, notice)
             else:
                 await query.edit_message_text(
                     "Произошла ошибка при удалении пользователя."
                 )
 
         except Exception as e:
-            logger.error(f"Error in delete_user: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in delete_user: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при удалении пользователя: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
@@ -697,40 +861,12 @@ class AdminHandler:
 
     async def import_questions(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /import для импорта вопросов из JSON файла"""
-        user_id = update.effective_user.id
-
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await update.message.reply_text(
-                "У вас нет прав для импорта вопросов."
-            )
+        if not await require_admin(update, "У вас нет прав для импорта вопросов."):
             return
 
         await update.message.reply_text(
-            "Для импорта вопросов отправьте JSON файл с вопросами.\n\n"
-            "Структура файла должна соответствовать формату:\n"
-            "```\n"
-            "{\n"
-            '  "topic": {\n'
-            '    "id": 1,\n'
-            '    "name": "Название темы",\n'
-            '    "description": "Описание темы"\n'
-            "  },\n"
-            '  "questions": [\n'
-            "    {\n"
-            '      "id": 1,\n'
-            '      "text": "Текст вопроса",\n'
-            '      "options": ["Вариант 1", "Вариант 2", ...],\n'
-            '      "correct_answer": [0],\n'
-            '      "question_type": "single",\n'
-            '      "difficulty": 1,\n'
-            '      "explanation": "Объяснение ответа"\n'
-            "    },\n"
-            "    ...\n"
-            "  ]\n"
-            "}\n"
-            "```\n\n"
-            "Или просто используйте команду /admin и выберите 'Импорт вопросов'.",
+            _IMPORT_HELP_TEXT,
             parse_mode="Markdown"
         )
 
@@ -743,28 +879,30 @@ class AdminHandler:
         user_id = update.effective_user.id
 
         # Проверка прав администратора
-        if str(user_id) not in ADMINS:
-            await query.edit_message_text(
-                "У вас нет прав для доступа к этой информации."
-            )
+        if not await require_admin(update, "У вас нет прав для доступа к этой информации."):
             return
 
         try:
-            # Получаем статистику по динамике за последний месяц
-            with get_session() as session:
-                # Получаем данные за последний месяц
-                from datetime import datetime, timedelta
+            cache_key = datetime.utcnow().strftime("%Y%m%d%H")
+            cached = _dynamics_cache.get(cache_key)
+            if cached is not None and time.time() - cached[0] < _DYNAMICS_TTL:
+                _, png, text = cached
+            else:
+                # Получаем статистику по динамике за последний месяц
                 month_ago = datetime.utcnow() - timedelta(days=30)
-
-                # Получаем результаты тестов
-                results = session.query(TestResult).filter(
-                    TestResult.completed_at >= month_ago
-                ).order_by(TestResult.completed_at).all()
-
-                if not results:
+                with get_session() as session:
+                    # Средний результат и число тестов по дням считает сама база
+                    day = func.date(TestResult.completed_at).label("day")
+                    daily = session.execute(
+                        select(day, func.avg(TestResult.percentage), func.count(TestResult.id))
+                        .where(TestResult.completed_at >= month_ago)
+                        .group_by(day)
+                        .order_by(day)
+                    ).all()
+
+                if not daily:
                     # Используем готовую клавиатуру для возврата
-                    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
+                    reply_markup = _BACK_MAIN_MARKUP
 
                     await query.edit_message_text(
                         "Нет данных о результатах тестов за последний месяц.",
@@ -772,97 +910,75 @@ class AdminHandler:
                     )
                     return
 
-                # Группируем результаты по дням
-                import pandas as pd
-                results_data = []
-                for result in results:
-                    results_data.append({
-                        "date": result.completed_at.date(),
-                        "percentage": result.percentage
-                    })
-
-                df = pd.DataFrame(results_data)
-                daily_avg = df.groupby("date")["percentage"].mean().reset_index()
-
-                # Создаем график
-                import matplotlib.pyplot as plt
-                from io import BytesIO
-
-                fig, ax = plt.subplots(figsize=(10, 6))
-                ax.plot(daily_avg["date"], daily_avg["percentage"], marker='o', linestyle='-')
-
-                ax.set_title("Динамика результатов тестирования за последний месяц")
-                ax.set_xlabel("Дата")
-                ax.set_ylabel("Средний процент")
-                ax.grid(True)
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-
-                # Сохраняем график в буфер
-                img_buf = BytesIO()
-                plt.savefig(img_buf, format='png')
-                img_buf.seek(0)
-                plt.close()
-
-                # Отправляем текст
-                text = "📈 *Динамика результатов тестирования*\n\n"
-                text += f"• Период: последние 30 дней\n"
-                text += f"• Всего тестов: {len(results)}\n"
-                text += f"• Средний результат: {df['percentage'].mean():.1f}%\n"
-
-                # Рассчитываем тренд (улучшение или ухудшение)
-                if len(daily_avg) > 1:
-                    first_week = df[df["date"] <= df["date"].min() + timedelta(days=7)]["percentage"].mean()
-                    last_week = df[df["date"] >= df["date"].max() - timedelta(days=7)]["percentage"].mean()
+                # SQLite возвращает дату строкой, PostgreSQL - объектом date
+                dates = [d if isinstance(d, date) else date.fromisoformat(d) for d, _, _ in daily]
+                averages = [float(avg) for _, avg, _ in daily]
+                counts = [n for _, _, n in daily]
+                total_tests = sum(counts)
+
+                # Растеризация занимает процессор - строим график вне цикла событий
+                png = await asyncio.to_thread(_render_dynamics_png, dates, averages)
+
+                # Текст сводки: строки собираем в список и склеиваем один раз
+                parts = [
+                    "📈 *Динамика результатов тестирования*",
+                    "",
+                    "• Период: последние 30 дней",
+                    f"• Всего тестов: {total_tests}",
+                    f"• Средний результат: {_weighted_mean(averages, counts):.1f}%"
+                ]
+
+                # Рассчитываем тренд (улучшение или ухудшение): средние дневные значения
+                # взвешиваем числом тестов, как если бы усредняли сами результаты
+                if len(dates) > 1:
+                    first_days = [i for i, d in enumerate(dates) if d <= dates[0] + timedelta(days=7)]
+                    last_days = [i for i, d in enumerate(dates) if d >= dates[-1] - timedelta(days=7)]
+                    first_week = _weighted_mean([averages[i] for i in first_days], [counts[i] for i in first_days])
+                    last_week = _weighted_mean([averages[i] for i in last_days], [counts[i] for i in last_days])
                     trend_diff = last_week - first_week
 
                     if abs(trend_diff) > 0.1:
                         trend_text = "улучшение" if trend_diff > 0 else "ухудшение"
-                        text += f"• Тренд: {trend_text} на {abs(trend_diff):.1f}%\n"
+                        parts.append(f"• Тренд: {trend_text} на {abs(trend_diff):.1f}%")
 
-                # Создаем клавиатуру
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                text = "\n".join(parts)
 
-                await query.edit_message_text(
-                    text,
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
+                # В кэше держим только текущий час
+                _dynamics_cache.clear()
+                _dynamics_cache[cache_key] = (time.time(), png, text)
 
-                # Отправляем график
-                await context.bot.send_photo(
-                    chat_id=user_id,
-                    photo=img_buf,
-                    caption="Динамика средних результатов по дням"
-                )
+            await query.edit_message_text(
+                text,
+                reply_markup=_DYNAMICS_MARKUP,
+                parse_mode="Markdown"
+            )
+
+            # Отправляем график: байты из кэша передаются как есть, без обертки в поток
+            await context.bot.send_photo(
+                chat_id=user_id,
+                photo=png,
+                caption="Динамика средних результатов по дням"
+            )
 
         except Exception as e:
-            logger.error(f"Error in show_results_dynamics: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_results_dynamics: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении динамики результатов: {str(e)}",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-                ]])
+                reply_markup=_BACK_MAIN_MARKUP
             )
 
     async def show_question_analysis(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Показ детального анализа проблемных вопросов"""
         query = update.callback_query
-        user_id = update.effective_user.id
 
         # Проверка прав администратора
-        if str(user_id) not in ADMINS:
-            await query.edit_message_text(
-                "У вас нет прав для доступа к этой информации."
-            )
+        if not await require_admin(update, "У вас нет прав для доступа к этой информации."):
             return
 
         try:
             # Получаем расширенную статистику проблемных вопросов
             from services.stats_service import get_problematic_questions
-            result = get_problematic_questions(limit=20)  # Увеличиваем лимит для подробного анализа
+            result = await _run_report(get_problematic_questions, limit=20)  # Увеличиваем лимит для подробного анализа
 
             if not result["success"]:
                 await query.edit_message_text(
@@ -871,9 +987,7 @@ class AdminHandler:
                 return
 
             if not result.get("has_data", False):
-                # Создаем клавиатуру для возврата
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_problematic_questions")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                reply_markup = _BACK_PROBLEMATIC_MARKUP
 
                 await query.edit_message_text(
                     "Нет данных о проблемных вопросах для детального анализа. Возможно, еще не было пройдено достаточно тестов.",
@@ -884,62 +998,38 @@ class AdminHandler:
             # Форматируем текст с детальным анализом
             problematic_questions = result["problematic_questions"]
 
-            # Сортируем вопросы по уровню ошибок
-            problematic_questions.sort(key=lambda q: q["error_rate"], reverse=True)
-
-            text = "🔍 *Детальный анализ проблемных вопросов*\n\n"
-            text += "Ниже представлен подробный анализ вопросов, вызывающих наибольшие затруднения у учеников.\n\n"
-
-            # Группируем вопросы по темам
-            topics_data = {}
-            for question in problematic_questions:
-                topic_id = question["topic_id"]
-                if topic_id not in topics_data:
-                    topics_data[topic_id] = {
-                        "name": question["topic_name"],
-                        "questions": [],
-                        "avg_error_rate": 0
-                    }
-                topics_data[topic_id]["questions"].append(question)
-
-            # Рассчитываем средний процент ошибок для каждой темы
-            for topic_id, topic_data in topics_data.items():
-                if topic_data["questions"]:
-                    topic_data["avg_error_rate"] = sum(q["error_rate"] for q in topic_data["questions"]) / len(
-                        topic_data["questions"])
-
-            # Сортируем темы по среднему проценту ошибок
-            sorted_topics = sorted(topics_data.items(), key=lambda x: x[1]["avg_error_rate"], reverse=True)
-
-            # Выводим статистику по темам
-            text += "*Статистика по темам:*\n"
-            for topic_id, topic_data in sorted_topics:
-                topic_name = topic_data["name"]
-                avg_error = topic_data["avg_error_rate"]
-                questions_count = len(topic_data["questions"])
+            # Вопросы уже отсортированы сервисом по убыванию процента ошибок
+            # Строки собираем в список и склеиваем один раз
+            parts = [
+                "🔍 *Детальный анализ проблемных вопросов*",
+                "",
+                "Ниже представлен подробный анализ вопросов, вызывающих наибольшие затруднения у учеников.",
+                ""
+            ]
 
-                text += f"• *{topic_name}*: {avg_error:.1f}% ошибок (всего вопросов: {questions_count})\n"
+            # Выводим статистику по темам, от самых сложных к простым
+            parts.append("*Статистика по темам:*")
+            parts.extend(
+                f"• *{topic_name}*: {avg_error:.1f}% ошибок (всего вопросов: {questions_count})"
+                for topic_name, avg_error, questions_count in _aggregate_topics(problematic_questions)
+            )
 
-            text += "\n*Топ-10 самых проблемных вопросов:*\n"
+            parts.extend(("", "*Топ-10 самых проблемных вопросов:*"))
             for i, question in enumerate(problematic_questions[:10], 1):
-                short_question = question["question_text"][:50] + "..." if len(question["question_text"]) > 50 else \
-                question["question_text"]
-                text += f"{i}. *{short_question}*\n"
-                text += f"   Тема: {question['topic_name']}\n"
-                text += f"   Процент ошибок: {question['error_rate']}%\n"
-                text += f"   Всего ответов: {question['total_answers']}\n\n"
+                short = _clip(question["question_text"])
+                parts.append(_PROBLEM_TMPL.format_map({**question, "i": i, "short": short}))
 
             # Рекомендации по улучшению
-            text += "*Рекомендации:*\n"
-            text += "• Обратите внимание на темы с высоким процентом ошибок\n"
-            text += "• Рассмотрите возможность пересмотра формулировок сложных вопросов\n"
-            text += "• Добавьте подробные объяснения к проблемным вопросам\n"
-            text += "• Создайте дополнительные материалы по сложным темам\n"
+            parts.extend((
+                "*Рекомендации:*",
+                "• Обратите внимание на темы с высоким процентом ошибок",
+                "• Рассмотрите возможность пересмотра формулировок сложных вопросов",
+                "• Добавьте подробные объяснения к проблемным вопросам",
+                "• Создайте дополнительные материалы по сложным темам"
+            ))
+            text = "\n".join(parts)
 
-            # Создаем клавиатуру для возврата
-            keyboard = [
-                [InlineKeyboardButton("🔙 Назад к проблемным вопросам", callback_data="admin_problematic_questions")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = _QUESTION_ANALYSIS_MARKUP
 
             # Отправляем сообщение с текстом
             await query.edit_message_text(
@@ -949,18 +1039,14 @@ class AdminHandler:
             )
 
         except Exception as e:
-            logger.error(f"Error in show_question_analysis: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_question_analysis: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при анализе проблемных вопросов: {str(e)}",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Назад", callback_data="admin_problematic_questions")
-                ]])
+                reply_markup=_BACK_PROBLEMATIC_MARKUP
             )
 
     async def handle_admin_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик нажатий кнопок в панели администратора"""
-        global new_state
         query = update.callback_query
         callback_data = query.data
         user_id = update.effective_user.id
@@ -972,544 +1058,328 @@ class AdminHandler:
         # Дополнительные проверки callback-данных
         logger.info(f"Обработка кнопки администратора: {query.data}")
 
-        user_id = update.effective_user.id
-
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await query.edit_message_text(
-                "У вас нет прав для доступа к панели администратора."
-            )
+        if not await require_admin(update, "У вас нет прав для доступа к панели администратора."):
             return
 
         try:
-            # Используем контекстный менеджер для всех операций с базой данных
-            if query.data == "admin_problematic_questions":
-                # Показываем список проблемных вопросов
-                await self.show_problematic_questions(update, context)
-
-            elif query.data == "admin_results_dynamics":
-            # Показываем динамику результатов
-                await self.show_results_dynamics(update, context)
-
-
-
-            elif query.data == "admin_export":
-                keyboard = [
-                    [
-                        InlineKeyboardButton("📊 Результаты тестов", callback_data="admin_export_results"),
-                        InlineKeyboardButton("📈 Статистика по темам", callback_data="admin_export_topics")
-                    ],
-                    [
-                        InlineKeyboardButton("👨‍🎓 Прогресс учеников", callback_data="admin_export_students"),
-                        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(
-                    "Выберите тип данных для экспорта:",
-                    reply_markup=reply_markup
-                )
-            elif query.data == "admin_topic_stats":
-                # Показываем статистику по темам
-                await self.show_topic_stats(update, context)
-
-            elif query.data == "admin_users":
-                # Показываем список пользователей
-                await self.show_users_list(update, context)
-
-            elif query.data == "admin_edit_topics":
-                # Показываем список тем для редактирования
-                await show_topics_list(update, context)
-
-            elif query.data == "admin_add_question":
-                # Переход к добавлению вопроса
-                with get_session() as session:
-                    topics = session.query(Topic).all()
-                    # Преобразуем объекты в словари для передачи в функцию клавиатуры
-                    topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
+            # Точные совпадения ищем по словарю
+            handler = self._exact_handlers.get(callback_data)
+            if handler:
+                await handler(update, context)
+                return
 
-                if not topics_data:
-                    await query.edit_message_text(
-                        "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
-                    )
+            # Числовой параметр в конце: одно разбиение строки и поиск действия по словарю
+            action, _, param = callback_data.rpartition("_")
+            if param.isdigit():
+                handler = self._id_handlers.get(action)
+                if handler:
+                    await handler(update, context, int(param))
                     return
 
-                # Используем готовую клавиатуру
-                reply_markup = admin_topics_keyboard(topics_data)
-
-                await query.edit_message_text(
-                    "Выберите тему для нового вопроса:",
-                    reply_markup=reply_markup
-                )
-
-                # Устанавливаем состояние для пользователя
-                context.user_data["admin_state"] = "adding_question"
-
-            elif query.data == "admin_import":
-                # Инструкция по импорту вопросов
-                await query.edit_message_text(
-                    "Для импорта вопросов отправьте JSON файл с вопросами.\n\n"
-                    "Структура файла должна соответствовать формату:\n"
-                    "```\n"
-                    "{\n"
-                    '  "topic": {\n'
-                    '    "id": 1,\n'
-                    '    "name": "Название темы",\n'
-                    '    "description": "Описание темы"\n'
-                    "  },\n"
-                    '  "questions": [\n'
-                    "    {\n"
-                    '      "id": 1,\n'
-                    '      "text": "Текст вопроса",\n'
-                    '      "options": ["Вариант 1", "Вариант 2", ...],\n'
-                    '      "correct_answer": [0],\n'
-                    '      "question_type": "single",\n'
-                    '      "difficulty": 1,\n'
-                    '      "explanation": "Объяснение ответа"\n'
-                    "    },\n"
-                    "    ...\n"
-                    "  ]\n"
-                    "}\n"
-                    "```\n\n"
-                    "Отправьте файл как документ в этот чат.",
-                    parse_mode="Markdown"
-                )
-
-                # Устанавливаем состояние для пользователя
-                context.user_data["admin_state"] = "importing_questions"
-
-
-            elif query.data.startswith("admin_export_"):
-                export_action = query.data.replace("admin_export_", "")
-
-                if export_action == "results":
-                    # Показать меню выбора периода для результатов тестов
-                    keyboard = [
-                        [
-                            InlineKeyboardButton("За неделю", callback_data="admin_export_results_week"),
-                            InlineKeyboardButton("За месяц", callback_data="admin_export_results_month")
-                        ],
-                        [
-                            InlineKeyboardButton("За год", callback_data="admin_export_results_year"),
-                            InlineKeyboardButton("За всё время", callback_data="admin_export_results_all")
-                        ],
-                        [
-                            InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-                        ]
-                    ]
-
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-
-                    await query.edit_message_text(
-                        "Выберите период для экспорта результатов тестов:",
-                        reply_markup=reply_markup
-                    )
-                elif export_action == "topics":
-                    # Сразу экспортируем статистику по темам
-                    await self.handle_export_button(update, context, "topics")
-                elif export_action == "students":
-                    # Сразу экспортируем прогресс учеников
-                    await self.handle_export_button(update, context, "students")
-                elif export_action.startswith("results_"):
-                    # Экспорт результатов тестов за период
-                    period = export_action.replace("results_", "")
-                    await self.handle_export_button(update, context, "results", period)
-
-            elif query.data.startswith("admin_edit_topics_"):
-
-                # Редактирование выбранной темы, только если это прямой вызов без суффиксов name/desc
-
-                if not any(x in query.data for x in ["name_", "desc_"]):
-
-                    topic_id = int(query.data.replace("admin_edit_topics_", ""))
-
-                    with get_session() as session:
-
-                        topic = session.query(Topic).get(topic_id)
-
-                        if not topic:
-                            await query.edit_message_text(
-                                "Тема не найдена."
-                            )
-                            return
-                        # Используем готовую клавиатуру
-                        reply_markup = admin_edit_topic_keyboard(topic_id)
-                        await query.edit_message_text(
-                            f"*Редактирование темы:* {topic.name}\n\n"
-                            f"*Описание:* {topic.description or 'Нет описания'}\n\n"
-                            "Выберите действие:",
-                            reply_markup=reply_markup,
-                            parse_mode="Markdown"
-                        )
-
-
-            elif query.data == "admin_back_topics_list":
-                # Возврат к списку тем
-                await self.show_topics_list(update, context)
-
-            # Обработчики для редактирования тем - с исправленными проверками
-            elif query.data.startswith("admin_edit_topic_name_"):
-                topic_id = int(query.data.replace("admin_edit_topic_name_", ""))
-                logger.info(f"Изменение названия темы с ID {topic_id}")
-                await self.handle_topic_edit_action(update, context, "name", topic_id)
-            elif query.data.startswith("admin_edit_topic_desc_"):
-                topic_id = int(query.data.replace("admin_edit_topic_desc_", ""))
-                logger.info(f"Изменение описания темы с ID {topic_id}")
-                await self.handle_topic_edit_action(update, context, "desc", topic_id)
-
-            elif query.data.startswith("admin_delete_topic_"):
-                topic_id = int(query.data.replace("admin_delete_topic_", ""))
-                logger.info(f"Запрос на удаление темы с ID {topic_id}")
-                with get_session() as session:
-                    topic = session.query(Topic).get(topic_id)
-                    if not topic:
-                        await query.edit_message_text("Тема не найдена.")
-                        return
-                    # Сохраняем имя темы и количество вопросов
-                    topic_name = topic.name
-                    questions_count = session.query(Question).filter(Question.topic_id == topic_id).count()
-                # Используем готовую клавиатуру для подтверждения
-                reply_markup = admin_confirm_delete_keyboard(topic_id)
-                warning_text = ""
-                if questions_count > 0:
-                    warning_text = f"\n⚠️ ВНИМАНИЕ! К этой теме привязано {questions_count} вопросов. При удалении темы все связанные вопросы также будут удалены."
-                await query.edit_message_text(
-                    f"Вы уверены, что хотите удалить тему '{topic_name}'?{warning_text}",
-                    reply_markup=reply_markup
-
-                )
+            for prefix, handler in self._prefix_handlers:
+                if callback_data.startswith(prefix):
+                    await handler(update, context, callback_data[len(prefix):])
+                    return
 
-            elif query.data == "admin_settings":
-                # Настройки бота
-                await self.show_bot_settings(update, context)
+            logger.warning(f"Неизвестная кнопка администратора: {callback_data}")
 
-            elif query.data == "admin_setting_questions_count":
-                # Обработка настройки количества вопросов в тесте
-                reply_markup = admin_questions_count_keyboard()
-                await query.edit_message_text(
-                    "Укажите количество вопросов в тесте по умолчанию (от 5 до 20):",
-                    reply_markup=reply_markup
-                )
+        except Exception as e:
+            logger.exception("Error in handle_admin_button: %s", e)
+            await query.edit_message_text(
+                f"Произошла ошибка при обработке запроса: {str(e)}"
+            )
 
+    async def _refresh_dynamics(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Сбрасывает готовый график динамики и строит его заново"""
+        _dynamics_cache.clear()
+        await self.show_results_dynamics(update, context)
 
-            elif query.data == "admin_setting_reports":
-                # Обработка настройки отчетов родителям
-                from config import ENABLE_PARENT_REPORTS
-                current_state = "включены" if ENABLE_PARENT_REPORTS else "отключены"
-                reply_markup = admin_reports_keyboard()
-                await query.edit_message_text(
-                    f"Автоматические отчеты родителям сейчас {current_state}.\n\n"
-                    "Выберите действие:",
-                    reply_markup=reply_markup
-                )
+    async def _show_export_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Меню выбора типа данных для экспорта"""
+        query = update.callback_query
+        await query.edit_message_text(
+            "Выберите тип данных для экспорта:",
+            reply_markup=_EXPORT_MENU_MARKUP
+        )
 
-            elif query.data == "admin_setting_questions_count":
-                # Обработка настройки количества вопросов в тесте
-                from services.settings_service import get_setting
-                default_questions_count = get_setting("default_questions_count", "10")
-                reply_markup = admin_questions_count_keyboard()
-                await query.edit_message_text(
-                    f"Текущее количество вопросов в тесте: {default_questions_count}\n\n"
-                    "Выберите новое количество вопросов:",
-                    reply_markup=reply_markup
-                )
+    async def _choose_question_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Переход к добавлению вопроса: выбор темы"""
+        query = update.callback_query
+        topics = cached_topics()
 
-            elif query.data.startswith("admin_reports_"):
-                # Включение/отключение отчетов
-                action = query.data.replace("admin_reports_", "")
+        if not topics:
+            await query.edit_message_text(
+                "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
+            )
+            return
 
-                try:
-                    # Здесь код для изменения настройки
-                    # Например, через изменение переменной окружения или config файла
-                    import os
-                    from dotenv import load_dotenv, set_key
-                    # Путь к файлу .env
-                    env_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-                    new_state = "включены" if action == "enable" else "отключены"
-                    # Если файл .env существует, обновляем его
-                    if os.path.exists(env_path):
-                        # Устанавливаем новое значение
-                        set_key(env_path, "ENABLE_PARENT_REPORTS", "true" if action == "enable" else "false")
-
-                        # Перезагружаем переменные окружения
-                        load_dotenv(override=True)
-
-                        # Обновляем значение в конфигурации
-                        from config import ENABLE_PARENT_REPORTS
-                        new_state = "включены" if action == "enable" else "отключены"
-
-                        await query.edit_message_text(
-                            f"✅ Автоматические отчеты родителям {new_state}.\n\n"
-                            "Настройка применена.",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
-                            ]])
-                        )
+        # Используем готовую клавиатуру
+        reply_markup = _topic_picker_markup(topics)
 
-                    else:
-                        # Если файл .env не существует, сообщаем об ошибке
-                        await query.edit_message_text(
-                            "Файл конфигурации не найден. Настройка не может быть изменена автоматически.\n"
-                            "Пожалуйста, измените значение ENABLE_PARENT_REPORTS вручную в файле конфигурации.",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
-                            ]])
-                        )
-                except Exception as e:
-                    logger.error(f"Error changing parent reports setting: {e}")
-                    await query.edit_message_text(
-                        f"Произошла ошибка при изменении настроек: {str(e)}",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")
-                        ]])
-                    )
+        await query.edit_message_text(
+            "Выберите тему для нового вопроса:",
+            reply_markup=reply_markup
+        )
 
-                    await query.edit_message_text(
-                        f"✅ Автоматические отчеты родителям {new_state}.\n\n"
-                        "Настройка будет применена при следующем запуске бота.",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
-                        ]])
-                    )
+    async def _start_add_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Начало добавления вопроса"""
+        await self._choose_question_topic(update, context)
+        # Устанавливаем состояние для пользователя
+        context.user_data["admin_state"] = "adding_question"
 
-            elif query.data.startswith("admin_set_questions_"):
-                # Установка количества вопросов
-                count = query.data.replace("admin_set_questions_", "")
+    async def _show_import_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Инструкция по импорту вопросов"""
+        query = update.callback_query
+        await query.edit_message_text(
+            _IMPORT_BUTTON_HELP_TEXT,
+            parse_mode="Markdown"
+        )
 
-                try:
-                    from services.settings_service import set_setting
-                    set_setting("default_questions_count", count)
-
-                    # Определяем время в зависимости от количества вопросов
-                    questions_count = int(count)
-                    if questions_count <= 10:
-                        time_minutes = 5
-                    elif questions_count <= 15:
-                        time_minutes = 10
-                    else:
-                        time_minutes = 20
+        # Устанавливаем состояние для пользователя
+        context.user_data["admin_state"] = "importing_questions"
 
-                    await query.edit_message_text(
-                        f"✅ Количество вопросов в тесте изменено на {count}.\n"
-                        f"Время на прохождение теста: {time_minutes} минут.\n\n"
-                        "Настройка будет применена к новым тестам.",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
-                        ]])
-                    )
-                except Exception as e:
-                    logger.error(f"Error setting questions count: {e}")
-                    await query.edit_message_text(
-                        f"Произошла ошибка при изменении настроек: {str(e)}",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")
-                        ]])
-                    )
+    async def _show_questions_count_setting(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработка настройки количества вопросов в тесте"""
+        query = update.callback_query
+        from services.settings_service import get_setting
+        default_questions_count = get_setting("default_questions_count", "10")
+        reply_markup = admin_questions_count_keyboard()
+        await query.edit_message_text(
+            f"Текущее количество вопросов в тесте: {default_questions_count}\n\n"
+            "Выберите новое количество вопросов:",
+            reply_markup=reply_markup
+        )
 
-            elif query.data.startswith("admin_select_topic_"):
-                # Выбор темы для нового вопроса
-                topic_id = int(query.data.replace("admin_select_topic_", ""))
-                context.user_data["selected_topic_id"] = topic_id
+    async def _show_reports_setting(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработка настройки отчетов родителям"""
+        query = update.callback_query
+        from services.settings_service import parent_reports_enabled
+        current_state = "включены" if parent_reports_enabled() else "отключены"
+        reply_markup = admin_reports_keyboard()
+        await query.edit_message_text(
+            f"Автоматические отчеты родителям сейчас {current_state}.\n\n"
+            "Выберите действие:",
+            reply_markup=reply_markup
+        )
 
-                # Предлагаем выбрать тип вопроса
-                reply_markup = admin_question_type_keyboard()
+    async def _start_add_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Добавление новой темы"""
+        query = update.callback_query
+        await query.edit_message_text(
+            "Отправьте название и описание новой темы в формате:\n\n"
+            "Название темы\n"
+            "Описание темы"
+        )
 
-                await query.edit_message_text(
-                    "Выберите тип вопроса:",
-                    reply_markup=reply_markup
-                )
+        # Устанавливаем состояние для пользователя
+        context.user_data["admin_state"] = "adding_topic"
 
-            elif query.data.startswith("admin_question_type_"):
-                # Выбор типа вопроса
-                question_type = query.data.replace("admin_question_type_", "")
-                context.user_data["question_type"] = question_type
+    async def _export(self, update: Update, context: ContextTypes.DEFAULT_TYPE, export_action: str) -> None:
+        """Кнопки экспорта: меню периода или сразу выгрузка"""
+        query = update.callback_query
+        if export_action == "results":
+            # Показать меню выбора периода для результатов тестов
+            await query.edit_message_text(
+                "Выберите период для экспорта результатов тестов:",
+                reply_markup=_RESULTS_PERIOD_MARKUP
+            )
+        elif export_action == "topics":
+            # Сразу экспортируем статистику по темам
+            await self.handle_export_button(update, context, "topics")
+        elif export_action == "students":
+            # Сразу экспортируем прогресс учеников
+            await self.handle_export_button(update, context, "students")
+        elif export_action.startswith("results_"):
+            # Экспорт результатов тестов за период
+            period = export_action[len("results_"):]
+            await self.handle_export_button(update, context, "results", period)
+
+    async def _open_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        """Редактирование выбранной темы"""
+        query = update.callback_query
 
-                # Предлагаем ввести текст вопроса
-                await query.edit_message_text(
-                    "Отправьте текст вопроса в следующем сообщении."
-                )
+        # Тема берется из кэша тем, без запроса к базе
+        topic = get_cached_topic(topic_id)
+        if not topic:
+            await query.edit_message_text(
+                "Тема не найдена."
+            )
+            return
+        # Используем готовую клавиатуру
+        reply_markup = admin_edit_topic_keyboard(topic_id)
+        await query.edit_message_text(
+            f"*Редактирование темы:* {topic['name']}\n\n"
+            f"*Описание:* {topic['description'] or 'Нет описания'}\n\n"
+            "Выберите действие:",
+            reply_markup=reply_markup,
+            parse_mode="Markdown"
+        )
 
-                # Обновляем состояние
-                context.user_data["admin_state"] = "entering_question_text"
+    async def _edit_topic_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        logger.info(f"Изменение названия темы с ID {topic_id}")
+        await self.handle_topic_edit_action(update, context, "name", topic_id)
 
-            elif query.data == "admin_question_analysis":
-                await self.show_question_analysis(update, context)
+    async def _edit_topic_desc(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        logger.info(f"Изменение описания темы с ID {topic_id}")
+        await self.handle_topic_edit_action(update, context, "desc", topic_id)
 
-            elif query.data == "admin_back_main":
-                # Возврат в главное меню администратора
-                await self.show_admin_panel(update, context)
+    async def _delete_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        """Запрос подтверждения удаления темы"""
+        query = update.callback_query
+        logger.info(f"Запрос на удаление темы с ID {topic_id}")
+        row = await run_in_session(_topic_delete_info, topic_id)
+        if not row:
+            await query.edit_message_text("Тема не найдена.")
+            return
+        topic_name, questions_count = row
+        # Используем готовую клавиатуру для подтверждения
+        reply_markup = admin_confirm_delete_keyboard(topic_id)
+        warning_text = ""
+        if questions_count > 0:
+            warning_text = f"\n⚠️ ВНИМАНИЕ! К этой теме привязано {questions_count} вопросов. При удалении темы все связанные вопросы также будут удалены."
+        await query.edit_message_text(
+            f"Вы уверены, что хотите удалить тему '{topic_name}'?{warning_text}",
+            reply_markup=reply_markup
 
-            elif query.data == "admin_back_topics":
-                # Возврат к списку тем
-                with get_session() as session:
-                    topics = session.query(Topic).all()
-                    topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
+        )
 
-                if not topics:
-                    await query.edit_message_text(
-                        "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
-                    )
-                    return
+    async def _reports(self, update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
+        """Включение/отключение отчетов"""
+        query = update.callback_query
+        new_state = "включены" if action == "enable" else "отключены"
 
-                # Используем готовую клавиатуру
-                reply_markup = admin_topics_keyboard(topics_data)
+        # Настройка хранится в базе: .env не переписывается и окружение не перезагружается
+        from services.settings_service import set_setting
+        if set_setting("enable_parent_reports", "true" if action == "enable" else "false"):
+            await query.edit_message_text(
+                f"✅ Автоматические отчеты родителям {new_state}.\n\n"
+                "Настройка применена.",
+                reply_markup=_BACK_SETTINGS_MARKUP
+            )
+        else:
+            await query.edit_message_text(
+                "Произошла ошибка при изменении настроек. Попробуйте позже.",
+                reply_markup=_SETTINGS_ERROR_MARKUP
+            )
 
-                await query.edit_message_text(
-                    "Выберите тему для нового вопроса:",
-                    reply_markup=reply_markup
-                )
+    async def _set_questions_count(self, update: Update, context: ContextTypes.DEFAULT_TYPE, count: int) -> None:
+        """Установка количества вопросов"""
+        query = update.callback_query
 
-            elif query.data == "admin_add_topic":
-                # Добавление новой темы
+        try:
+            from services.settings_service import set_setting, get_quiz_settings
+            if not set_setting("default_questions_count", count):
                 await query.edit_message_text(
-                    "Отправьте название и описание новой темы в формате:\n\n"
-                    "Название темы\n"
-                    "Описание темы"
+                    "Произошла ошибка при изменении настроек. Попробуйте позже.",
+                    reply_markup=_SETTINGS_ERROR_MARKUP
                 )
+                return
 
-                # Устанавливаем состояние для пользователя
-                context.user_data["admin_state"] = "adding_topic"
-
-            elif query.data.startswith("admin_edit_topic_"):
-                # Редактирование выбранной темы
-                topic_id = int(query.data.replace("admin_edit_topic_", ""))
-
-                with get_session() as session:
-                    topic = session.query(Topic).get(topic_id)
-
-                    if not topic:
-                        await query.edit_message_text(
-                            "Тема не найдена."
-                        )
-                        return
-
-                    # Используем готовую клавиатуру
-                    reply_markup = admin_edit_topics_keyboard(topic_id)
-
-                    await query.edit_message_text(
-                        f"*Редактирование темы:* {topic.name}\n\n"
-                        f"*Описание:* {topic.description or 'Нет описания'}\n\n"
-                        "Выберите действие:",
-                        reply_markup=reply_markup,
-                        parse_mode="Markdown"
-                    )
-
-            elif query.data == "admin_back_topics_list":
-                # Возврат к списку тем
-                await show_topics_list(update, context)
-
-            # Обработчики для редактирования тем
-            elif query.data.startswith("admin_edit_topics_desc_"):
-                topic_id = int(query.data.replace("admin_edit_topics_desc_", ""))
-                logger.info(f"Изменение описания темы с ID {topic_id}")
-                await self.handle_topic_edit_action(update, context, "desc", topic_id)
-
-
-            elif query.data.startswith("admin_delete_topic_"):
-                topic_id = int(query.data.replace("admin_delete_topic_", ""))
-
-                logger.info(f"Запрос на удаление темы с ID {topic_id}")
+            # Время на тест берем из тех же правил, по которым его ограничивает сам тест
+            time_minutes = get_quiz_settings()["time_minutes"]
 
-                with get_session() as session:
-                    topic = session.query(Topic).get(topic_id)
-                    if not topic:
-                        await query.edit_message_text("Тема не найдена.")
-                        return
+            await query.edit_message_text(
+                f"✅ Количество вопросов в тесте изменено на {count}.\n"
+                f"Время на прохождение теста: {time_minutes} минут.\n\n"
+                "Настройка будет применена к новым тестам.",
+                reply_markup=_BACK_SETTINGS_MARKUP
+            )
+        except Exception as e:
+            logger.exception("Error setting questions count: %s", e)
+            await query.edit_message_text(
+                f"Произошла ошибка при изменении настроек: {str(e)}",
+                reply_markup=_SETTINGS_ERROR_MARKUP
+            )
 
-                    # Проверяем, есть ли вопросы, связанные с этой темой
-                    questions_count = session.query(Question).filter(Question.topic_id == topic_id).count()
+    async def _select_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        """Выбор темы для нового вопроса"""
+        query = update.callback_query
+        context.user_data["selected_topic_id"] = topic_id
 
-                # Используем готовую клавиатуру для подтверждения
-                reply_markup = admin_confirm_delete_keyboard(topic_id)
+        # Предлагаем выбрать тип вопроса
+        reply_markup = admin_question_type_keyboard()
 
-                warning_text = ""
-                if questions_count > 0:
-                    warning_text = f"\n⚠️ ВНИМАНИЕ! К этой теме привязано {questions_count} вопросов. При удалении темы все связанные вопросы также будут удалены."
+        await query.edit_message_text(
+            "Выберите тип вопроса:",
+            reply_markup=reply_markup
+        )
 
-                await query.edit_message_text(
-                    f"Вы уверены, что хотите удалить тему '{topic.name}'?{warning_text}",
-                    reply_markup=reply_markup
-                )
+    async def _set_question_type(self, update: Update, context: ContextTypes.DEFAULT_TYPE, question_type: str) -> None:
+        """Выбор типа вопроса"""
+        query = update.callback_query
+        context.user_data["question_type"] = question_type
 
+        # Предлагаем ввести текст вопроса
+        await query.edit_message_text(
+            "Отправьте текст вопроса в следующем сообщении."
+        )
 
+        # Обновляем состояние
+        context.user_data["admin_state"] = "entering_question_text"
 
-            elif query.data.startswith("admin_confirm_delete_topic_"):
-                topic_id = int(query.data.replace("admin_confirm_delete_topic_", ""))
-                logger.info(f"Подтверждение удаления темы с ID {topic_id}")
-                try:
-                    topic_name = None
-                    with get_session() as session:
-                        topic = session.query(Topic).get(topic_id)
-                        if not topic:
-                            await query.edit_message_text("Тема не найдена.")
-                            return
-                        # Сохраняем имя темы до удаления
-                        topic_name = topic.name
-                        # Сначала удаляем все вопросы этой темы
-                        session.query(Question).filter(Question.topic_id == topic_id).delete()
-                        # Затем удаляем саму тему
-                        session.delete(topic)
-                        session.commit()
-                    if topic_name:
-                        await query.edit_message_text(f"✅ Тема '{topic_name}' и все связанные вопросы успешно удалены.")
-                        # Пауза перед показом списка тем
-                        await asyncio.sleep(2)
-                        await show_topics_list(update, context)
-                    else:
-                        await query.edit_message_text("Тема успешно удалена.")
-                        await show_topics_list(update, context)
+    async def _edit_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        """Редактирование выбранной темы"""
+        query = update.callback_query
 
-                except Exception as e:
-                    logger.error(f"Error deleting topic: {e}")
-                    await query.edit_message_text(
-                        f"Произошла ошибка при удалении темы: {str(e)}\n\n"
-                        "Пожалуйста, попробуйте еще раз."
-                    )
+        # Тема берется из кэша тем, без запроса к базе
+        topic = get_cached_topic(topic_id)
+        if not topic:
+            await query.edit_message_text(
+                "Тема не найдена."
+            )
+            return
 
-            # Обработчики для списков пользователей
-            elif query.data == "admin_list_students":
-                await self.show_students_list(update, context)
+        # Используем готовую клавиатуру
+        reply_markup = admin_edit_topics_keyboard(topic_id)
 
-            elif query.data == "admin_list_parents":
-                await self.show_parents_list(update, context)
+        await query.edit_message_text(
+            f"*Редактирование темы:* {topic['name']}\n\n"
+            f"*Описание:* {topic['description'] or 'Нет описания'}\n\n"
+            "Выберите действие:",
+            reply_markup=reply_markup,
+            parse_mode="Markdown"
+        )
 
-            # Для просмотра конкретного ученика
-            elif query.data.startswith("admin_view_student_"):
-                student_id = int(query.data.replace("admin_view_student_", ""))
-                await self.show_student_details(update, context, student_id)
+    async def _confirm_delete_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE, topic_id: int) -> None:
+        """Удаление темы вместе с ее вопросами"""
+        query = update.callback_query
+        logger.info(f"Подтверждение удаления темы с ID {topic_id}")
+        try:
+            topic_name = await run_in_session(_delete_topic_rows, topic_id)
+            if topic_name is None:
+                await query.edit_message_text("Тема не найдена.")
+                return
+            invalidate_topic(topic_id)
+            # Сообщение об удалении показываем над обновленным списком тем
+            await self.show_topics_list(
+                update, context, f"✅ Тема '{topic_name}' и все связанные вопросы успешно удалены."
+            )
 
-            # Для просмотра конкретного родителя
-            elif query.data.startswith("admin_view_parent_"):
-                parent_id = int(query.data.replace("admin_view_parent_", ""))
-                await self.show_parent_details(update, context, parent_id)
+        except Exception as e:
+            logger.exception("Error deleting topic: %s", e)
+            await query.edit_message_text(
+                f"Произошла ошибка при удалении темы: {str(e)}\n\n"
+                "Пожалуйста, попробуйте еще раз."
+            )
 
-            # Для подтверждения удаления ученика
-            elif query.data.startswith("admin_delete_student_"):
-                student_id = int(query.data.replace("admin_delete_student_", ""))
-                await self.confirm_delete_user(update, context, student_id, "student")
+    async def _view_student(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+        await self.show_student_details(update, context, user_id)
 
-            # Для подтверждения удаления родителя
-            elif query.data.startswith("admin_delete_parent_"):
-                parent_id = int(query.data.replace("admin_delete_parent_", ""))
-                await self.confirm_delete_user(update, context, parent_id, "parent")
+    async def _view_parent(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+        await self.show_parent_details(update, context, user_id)
 
-            # Для выполнения удаления ученика
-            elif query.data.startswith("admin_confirm_delete_student_"):
-                student_id = int(query.data.replace("admin_confirm_delete_student_", ""))
-                await self.delete_user(update, context, student_id, "student")
+    async def _delete_student(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+        await self.confirm_delete_user(update, context, user_id, "student")
 
-            # Для выполнения удаления родителя
-            elif query.data.startswith("admin_confirm_delete_parent_"):
-                parent_id = int(query.data.replace("admin_confirm_delete_parent_", ""))
-                await self.delete_user(update, context, parent_id, "parent")
+    async def _delete_parent(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+        await self.confirm_delete_user(update, context, user_id, "parent")
 
+    async def _confirm_delete_student(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+        await self.delete_user(update, context, user_id, "student")
 
-        except Exception as e:
-            logger.error(f"Error in handle_admin_button: {e}")
-            logger.error(traceback.format_exc())
-            await query.edit_message_text(
-                f"Произошла ошибка при обработке запроса: {str(e)}"
-            )
+    async def _confirm_delete_parent(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+        await self.delete_user(update, context, user_id, "parent")
 
     async def handle_export_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE, export_type: str,
                                    period: str = None) -> None:
@@ -1527,18 +1397,21 @@ class AdminHandler:
 
             # Генерируем файл в зависимости от типа
             if export_type == "results":
-                buffer = excel_service.export_test_results(period or "all")
+                export_func, export_args = excel_service.export_test_results, (period or "all",)
                 filename = f"test_results_{period or 'all'}_{datetime.now(timezone.utc).strftime('%Y%m%d')}.xlsx"
             elif export_type == "topics":
-                buffer = excel_service.export_topic_statistics()
+                export_func, export_args = excel_service.export_topic_statistics, ()
                 filename = f"topic_statistics_{datetime.now(timezone.utc).strftime('%Y%m%d')}.xlsx"
             elif export_type == "students":
-                buffer = excel_service.export_student_progress()
+                export_func, export_args = excel_service.export_student_progress, ()
                 filename = f"student_progress_{datetime.now(timezone.utc).strftime('%Y%m%d')}.xlsx"
             else:
                 await query.edit_message_text("Неизвестный тип экспорта.")
                 return
 
+            async with _EXPORT_SLOTS:
+                buffer = await _run_report(export_func, *export_args)
+
             # Удаляем сообщение о генерации
             await generating_msg.delete()
 
@@ -1551,20 +1424,15 @@ class AdminHandler:
             )
 
         except Exception as e:
-            logger.error(f"Error exporting to Excel: {e}")
+            logger.exception("Error exporting to Excel: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при экспорте: {str(e)}"
             )
 
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик загрузки документов (для импорта вопросов)"""
-        user_id = update.effective_user.id
-
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await update.message.reply_text(
-                "У вас нет прав для импорта вопросов."
-            )
+        if not await require_admin(update, "У вас нет прав для импорта вопросов."):
             return
 
         # Проверяем, ожидается ли загрузка файла
@@ -1580,21 +1448,12 @@ class AdminHandler:
             return
 
         try:
-            # Скачиваем файл
+            # Скачиваем файл в память: на диске он не нужен
             file = await context.bot.get_file(document.file_id)
-            file_path = f"downloads/{document.file_name}"
-            os.makedirs("downloads", exist_ok=True)
-            await file.download_to_drive(file_path)
-
-            # Обрабатываем файл
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = json.loads(await file.download_as_bytearray())
 
             # Импортируем вопросы
-            result = self.import_questions_from_json(data)
-
-            # Удаляем временный файл
-            os.remove(file_path)
+            result = await asyncio.to_thread(self.import_questions_from_json, data)
 
             if result["success"]:
                 await update.message.reply_text(
@@ -1608,7 +1467,7 @@ class AdminHandler:
                 )
 
         except Exception as e:
-            logger.error(f"Error importing questions: {e}")
+            logger.exception("Error importing questions: %s", e)
             await update.message.reply_text(
                 f"Произошла ошибка при обработке файла: {str(e)}"
             )
@@ -1618,14 +1477,10 @@ class AdminHandler:
 
     async def handle_admin_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE, state=None) -> None:
         """Обработчик текстовых сообщений от администратора в процессе редактирования"""
-        user_id = update.effective_user.id
         message_text = update.message.text
 
         # Проверяем, является ли пользователь администратором
-        if str(user_id) not in ADMINS:
-            await update.message.reply_text(
-                "У вас нет прав для выполнения этой операции."
-            )
+        if not await require_admin(update, "У вас нет прав для выполнения этой операции."):
             return
 
         # Проверяем состояние
@@ -1644,17 +1499,13 @@ class AdminHandler:
                 return
 
             try:
-                with get_session() as session:
-                    topic = session.query(Topic).get(topic_id)
-                    if not topic:
-                        await update.message.reply_text("Тема не найдена. Операция отменена.")
-                        context.user_data.pop("admin_state", None)
-                        context.user_data.pop("editing_topic_id", None)
-                        return
-
-                    old_name = topic.name
-                    topic.name = new_name
-                    session.commit()
+                old_name = await run_in_session(_rename_topic, topic_id, new_name)
+                if old_name is None:
+                    await update.message.reply_text("Тема не найдена. Операция отменена.")
+                    context.user_data.pop("admin_state", None)
+                    context.user_data.pop("editing_topic_id", None)
+                    return
+                invalidate_topic(topic_id)
 
                 await update.message.reply_text(f"✅ Название темы успешно изменено с '{old_name}' на '{new_name}'.")
 
@@ -1663,11 +1514,7 @@ class AdminHandler:
                 context.user_data.pop("editing_topic_id", None)
 
                 # Создаем клавиатуру для просмотра тем
-                with get_session() as session:
-                    topics = session.query(Topic).all()
-                    topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
-
-                reply_markup = admin_edit_topics_keyboard(topics_data)
+                reply_markup = _topics_edit_markup(cached_topics())
 
                 # Отправляем сообщение со списком тем
                 await update.message.reply_text(
@@ -1676,7 +1523,7 @@ class AdminHandler:
                 )
 
             except Exception as e:
-                logger.error(f"Error updating topic name: {e}")
+                logger.exception("Error updating topic name: %s", e)
                 await update.message.reply_text(f"Произошла ошибка при изменении названия темы: {str(e)}")
                 context.user_data.pop("admin_state", None)
                 context.user_data.pop("editing_topic_id", None)
@@ -1685,23 +1532,15 @@ class AdminHandler:
             topic_id = context.user_data.get("editing_topic_id")
             new_description = message_text.strip()
             try:
-                with get_session() as session:
-                    topic = session.query(Topic).get(topic_id)
-                    if not topic:
-                        await update.message.reply_text("Тема не найдена. Операция отменена.")
-                        context.user_data.pop("admin_state", None)
-                        context.user_data.pop("editing_topic_id", None)
-                        return
-
-                    # Сохраняем название темы и старое описание, пока сессия активна
-                    topic_name = topic.name
-                    old_description = topic.description or "Нет описания"
-
-                    # Обновляем описание
-                    topic.description = new_description
-                    session.commit()
+                topic_name = await run_in_session(_set_topic_description, topic_id, new_description)
+                if topic_name is None:
+                    await update.message.reply_text("Тема не найдена. Операция отменена.")
+                    context.user_data.pop("admin_state", None)
+                    context.user_data.pop("editing_topic_id", None)
+                    return
 
-                    logger.info(f"Описание темы {topic_id} успешно обновлено")
+                logger.info(f"Описание темы {topic_id} успешно обновлено")
+                invalidate_topic(topic_id)
 
                 await update.message.reply_text(
                     f"✅ Описание темы '{topic_name}' успешно обновлено."
@@ -1712,11 +1551,7 @@ class AdminHandler:
                 context.user_data.pop("editing_topic_id", None)
 
                 # Создаем клавиатуру для просмотра тем
-                with get_session() as session:
-                    topics = session.query(Topic).all()
-                    topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
-
-                reply_markup = admin_edit_topics_keyboard(topics_data)
+                reply_markup = _topics_edit_markup(cached_topics())
                 # Отправляем сообщение со списком тем
 
                 await update.message.reply_text(
@@ -1726,7 +1561,7 @@ class AdminHandler:
                 )
 
             except Exception as e:
-                logger.error(f"Error updating topic description: {e}")
+                logger.exception("Error updating topic description: %s", e)
                 await update.message.reply_text(f"Произошла ошибка при изменении описания темы: {str(e)}")
                 context.user_data.pop("admin_state", None)
                 context.user_data.pop("editing_topic_id", None)
@@ -1903,7 +1738,7 @@ class AdminHandler:
             }
 
             # Создаем новый вопрос
-            result = self.add_question_to_db(question_data)
+            result = await asyncio.to_thread(self.add_question_to_db, question_data)
 
             if result["success"]:
                 await update.message.reply_text(
@@ -1911,18 +1746,9 @@ class AdminHandler:
                 )
 
                 # Спрашиваем, хочет ли администратор добавить еще один вопрос
-                keyboard = [
-                    [
-                        InlineKeyboardButton("➕ Добавить еще вопрос", callback_data="admin_add_question"),
-                        InlineKeyboardButton("🔙 Вернуться в меню", callback_data="admin_back_main")
-                    ]
-                ]
-
-                reply_markup = InlineKeyboardMarkup(keyboard)
-
                 await update.message.reply_text(
                     "Выберите дальнейшее действие:",
-                    reply_markup=reply_markup
+                    reply_markup=_QUESTION_ADDED_MARKUP
                 )
             else:
                 await update.message.reply_text(
@@ -1949,7 +1775,7 @@ class AdminHandler:
             topic_description = '\n'.join(lines[1:]).strip() if len(lines) > 1 else None
 
             # Создаем новую тему
-            result = self.add_topic_to_db(topic_name, topic_description)
+            result = await asyncio.to_thread(self.add_topic_to_db, topic_name, topic_description)
 
             if result["success"]:
                 await update.message.reply_text(
@@ -1957,11 +1783,7 @@ class AdminHandler:
                 )
 
                 # Показываем обновленный список тем
-                with get_session() as session:
-                    topics = session.query(Topic).all()
-                    topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
-
-                reply_markup = admin_edit_topics_keyboard(topics_data)
+                reply_markup = _topics_edit_markup(cached_topics())
 
                 await update.message.reply_text(
                     "✏️ Список тем для редактирования:",
@@ -2007,57 +1829,62 @@ class AdminHandler:
                     topic.name = topic_data["name"]
                     topic.description = topic_data.get("description", topic.description)
 
+                # Существующие вопросы темы из файла загружаем одним запросом
+                question_ids = [q_data["id"] for q_data in questions_data if q_data.get("id") is not None]
+                existing_questions = {}
+                if question_ids:
+                    existing_questions = {
+                        question.id: question
+                        for question in session.scalars(
+                            select(Question).where(Question.topic_id == topic.id, Question.id.in_(question_ids))
+                        )
+                    }
+
                 # Добавляем вопросы
-                questions_count = 0
+                new_questions = []
                 for q_data in questions_data:
-                    # Проверяем, существует ли уже вопрос с таким ID в этой теме
-                    question = session.query(Question).filter(
-                        Question.topic_id == topic.id,
-                        Question.id == q_data.get("id")
-                    ).first()
+                    question = existing_questions.get(q_data.get("id"))
 
                     if not question:
-                        # Создаем новый вопрос
-                        options = q_data["options"]
-                        correct_answer = q_data["correct_answer"]
-                        question = Question(
-                            topic_id=topic.id,
-                            text=q_data["text"],
-                            options=json.dumps(options) if not isinstance(options, str) else options,
-                            correct_answer=json.dumps(correct_answer) if not isinstance(correct_answer,
-                                                                                        str) else correct_answer,
-                            question_type=q_data["question_type"],
-                            difficulty=q_data.get("difficulty", 1),
-                            media_url=q_data.get("media_url"),
-                            explanation=q_data.get("explanation", "")
-                        )
-                        session.add(question)
+                        # Новые вопросы вставляем одной пакетной командой после цикла
+                        new_questions.append({
+                            "topic_id": topic.id,
+                            "text": q_data["text"],
+                            "options": _json_field(q_data["options"]),
+                            "correct_answer": _json_field(q_data["correct_answer"]),
+                            "question_type": q_data["question_type"],
+                            "difficulty": q_data.get("difficulty", 1),
+                            "media_url": q_data.get("media_url"),
+                            "explanation": q_data.get("explanation", "")
+                        })
                     else:
                         # Обновляем существующий вопрос
-                        options = q_data["options"]
-                        correct_answer = q_data["correct_answer"]
                         question.text = q_data["text"]
-                        question.options = json.dumps(options) if not isinstance(options, str) else options
-                        question.correct_answer = json.dumps(correct_answer) if not isinstance(correct_answer,
-                                                                                               str) else correct_answer
+                        question.options = _json_field(q_data["options"])
+                        question.correct_answer = _json_field(q_data["correct_answer"])
                         question.question_type = q_data["question_type"]
                         question.difficulty = q_data.get("difficulty", question.difficulty)
                         question.media_url = q_data.get("media_url", question.media_url)
                         question.explanation = q_data.get("explanation", question.explanation)
 
-                    questions_count += 1
+                questions_count = len(questions_data)
+                if new_questions:
+                    session.execute(insert(Question), new_questions)
 
                 # Сохраняем изменения
                 session.commit()
-
-                return {
-                    "success": True,
-                    "topic_name": topic.name,
-                    "questions_count": questions_count
-                }
+                topic_id = topic.id
+                topic_name = topic.name
+
+            invalidate_topic(topic_id)
+            return {
+                "success": True,
+                "topic_name": topic_name,
+                "questions_count": questions_count
+            }
 
         except Exception as e:
-            logger.error(f"Error in import_questions_from_json: {e}")
+            logger.exception("Error in import_questions_from_json: %s", e)
             return {"success": False, "message": str(e)}
 
     def add_question_to_db(self, data: dict) -> dict:
@@ -2072,7 +1899,7 @@ class AdminHandler:
             with get_session() as session:
                 try:
                     # Проверяем существование темы
-                    topic = session.query(Topic).get(data["topic_id"])
+                    topic = session.get(Topic, data["topic_id"])
                     if not topic:
                         return {"success": False, "message": "Указанная тема не существует"}
 
@@ -2080,11 +1907,8 @@ class AdminHandler:
                     question = Question(
                         topic_id=data["topic_id"],
                         text=data["text"],
-                        options=json.dumps(data["options"]) if not isinstance(data["options"], str) else data[
-                            "options"],
-                        correct_answer=json.dumps(data["correct_answer"]) if not isinstance(data["correct_answer"],
-                                                                                            str) else data[
-                            "correct_answer"],
+                        options=_json_field(data["options"]),
+                        correct_answer=_json_field(data["correct_answer"]),
                         question_type=data["question_type"],
                         difficulty=data.get("difficulty", 1),
                         media_url=data.get("media_url"),
@@ -2097,11 +1921,11 @@ class AdminHandler:
                     return {"success": True, "question_id": question.id}
                 except Exception as db_error:
                     session.rollback()
-                    logger.error(f"Database error in add_question_to_db: {db_error}")
+                    logger.exception("Database error in add_question_to_db: %s", db_error)
                     return {"success": False, "message": str(db_error)}
 
         except Exception as e:
-            logger.error(f"Error in add_question_to_db: {e}")
+            logger.exception("Error in add_question_to_db: %s", e)
             return {"success": False, "message": str(e)}
 
     def add_topic_to_db(self, name: str, description: str = None) -> dict:
@@ -2125,11 +1949,13 @@ class AdminHandler:
 
                 session.add(topic)
                 session.commit()
+                topic_id = topic.id
 
-                return {"success": True, "topic_id": topic.id}
+            invalidate_topic(topic_id)
+            return {"success": True, "topic_id": topic_id}
 
         except Exception as e:
-            logger.error(f"Error in add_topic_to_db: {e}")
+            logger.exception("Error in add_topic_to_db: %s", e)
             return {"success": False, "message": str(e)}
 
     async def show_admin_panel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -2151,7 +1977,7 @@ class AdminHandler:
         query = update.callback_query
 
         # Получаем статистику по темам
-        stats = generate_topic_analytics()
+        stats = await _run_report(generate_topic_analytics)
 
         if not stats["success"]:
             await query.edit_message_text(
@@ -2180,11 +2006,7 @@ class AdminHandler:
                 stats_text += f"{emoji} {topic['topic_name']}: {topic['avg_score']}% (пройдено тестов: {topic['tests_count']})\n"
 
             # Кнопка для возврата
-            keyboard = [
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")]
-            ]
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = _BACK_MAIN_MARKUP
 
             # Отправляем текст статистики
             await query.edit_message_text(
@@ -2201,7 +2023,7 @@ class AdminHandler:
                     caption="📊 Средний результат по темам (от самых сложных к самым простым)"
                 )
         except Exception as e:
-            logger.error(f"Error in show_topic_stats: {e}")
+            logger.exception("Error in show_topic_stats: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при отображении статистики: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
@@ -2220,15 +2042,14 @@ class AdminHandler:
 
                 # Получаем список последних активных пользователей
                 # Важно: создаем копии данных, а не используем объекты сессии напрямую
-                recent_users = []
-                for user in session.query(User).order_by(User.last_active.desc()).limit(10).all():
-                    recent_users.append({
-                        "role": user.role,
-                        "full_name": user.full_name,
-                        "username": user.username,
-                        "telegram_id": user.telegram_id,
-                        "last_active": user.last_active
-                    })
+                recent_users = [
+                    row._asdict()
+                    for row in session.execute(
+                        select(User.role, User.full_name, User.username, User.telegram_id, User.last_active)
+                        .order_by(User.last_active.desc())
+                        .limit(10)
+                    )
+                ]
 
             # Форматируем текст со статистикой
             users_text = "👥 *Статистика пользователей*\n\n"
@@ -2253,7 +2074,7 @@ class AdminHandler:
                 parse_mode="Markdown"
             )
         except Exception as e:
-            logger.error(f"Error in show_users_list: {e}")
+            logger.exception("Error in show_users_list: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении списка пользователей: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
@@ -2263,27 +2084,19 @@ class AdminHandler:
         """Показ настроек бота"""
         query = update.callback_query
 
-        from config import ENABLE_PARENT_REPORTS
-        from services.settings_service import get_setting
-
-        # Получаем настройки
-        default_questions_count = get_setting("default_questions_count", "10")
+        from services.settings_service import get_quiz_settings, parent_reports_enabled
 
-        # Определяем время в зависимости от количества вопросов
-        questions_count = int(default_questions_count)
-        if questions_count <= 10:
-            time_minutes = 5
-        elif questions_count <= 15:
-            time_minutes = 10
-        else:
-            time_minutes = 20
+        # Получаем настройки: значения берутся из кэша, время теста уже посчитано
+        quiz_settings = get_quiz_settings()
+        default_questions_count = quiz_settings["questions_count"]
+        time_minutes = quiz_settings["time_minutes"]
 
         # Форматируем текст с настройками
         settings_text = "⚙️ *Настройки бота*\n\n"
         settings_text += "Здесь вы можете настроить общие параметры работы бота:\n\n"
 
         settings_text += "*Текущие настройки:*\n"
-        settings_text += f"• Автоматические отчеты родителям: {'Включено' if ENABLE_PARENT_REPORTS else 'Отключено'}\n"
+        settings_text += f"• Автоматические отчеты родителям: {'Включено' if parent_reports_enabled() else 'Отключено'}\n"
         settings_text += f"• Количество вопросов в тесте: {default_questions_count}\n"
         settings_text += f"• Время на прохождение теста: {time_minutes} минут\n\n"
 
@@ -2305,24 +2118,33 @@ class AdminHandler:
                 parse_mode="Markdown"
             )
 
-    async def show_students_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Показ списка учеников"""
+    async def show_students_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 notice: str = "") -> None:
+        """Показ списка учеников; notice - строка результата операции над списком"""
         query = update.callback_query
 
         try:
             with get_session() as session:
-                # Получаем список всех учеников
-                students = session.query(User).filter(User.role == "student").order_by(User.last_active.desc()).all()
+                # Получаем список всех учеников: только столбцы, нужные для списка
+                students = session.execute(
+                    select(User.id, User.full_name, User.username, User.telegram_id, User.last_active)
+                    .where(User.role == "student")
+                    .order_by(User.last_active.desc())
+                ).all()
+
+                # Результат операции показываем над списком
+                header = f"{notice}\n\n" if notice else ""
 
                 if not students:
                     await query.edit_message_text(
-                        "В базе данных нет зарегистрированных учеников.\n\n"
-                        "Нажмите /admin для возврата в панель администратора."
+                        f"{header}В базе данных нет зарегистрированных учеников.\n\n"
+                        "Нажмите /admin для возврата в панель администратора.",
+                        parse_mode="Markdown"
                     )
                     return
 
                 # Форматируем текст со списком учеников
-                students_text = "👨‍🎓 *Список учеников*\n\n"
+                students_text = header + "👨‍🎓 *Список учеников*\n\n"
                 students_text += "Выберите ученика для просмотра подробной информации и управления:\n\n"
 
                 # Создаем клавиатуру с кнопками для каждого ученика
@@ -2357,31 +2179,46 @@ class AdminHandler:
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            logger.error(f"Error in show_students_list: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_students_list: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении списка учеников: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
             )
 
-    async def show_parents_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Показ списка родителей"""
+    async def show_parents_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                notice: str = "") -> None:
+        """Показ списка родителей; notice - строка результата операции над списком"""
         query = update.callback_query
 
         try:
             with get_session() as session:
-                # Получаем список всех родителей
-                parents = session.query(User).filter(User.role == "parent").order_by(User.last_active.desc()).all()
+                # Получаем список всех родителей вместе с числом учеников одним запросом
+                children_count = (
+                    select(func.count())
+                    .select_from(parent_student)
+                    .where(parent_student.c.parent_id == User.id)
+                    .scalar_subquery()
+                )
+                parents = session.execute(
+                    select(User.id, User.full_name, User.username, User.telegram_id, User.last_active,
+                           children_count.label("children_count"))
+                    .where(User.role == "parent")
+                    .order_by(User.last_active.desc())
+                ).all()
+
+                # Результат операции показываем над списком
+                header = f"{notice}\n\n" if notice else ""
 
                 if not parents:
                     await query.edit_message_text(
-                        "В базе данных нет зарегистрированных родителей.\n\n"
-                        "Нажмите /admin для возврата в панель администратора."
+                        f"{header}В базе данных нет зарегистрированных родителей.\n\n"
+                        "Нажмите /admin для возврата в панель администратора.",
+                        parse_mode="Markdown"
                     )
                     return
 
                 # Форматируем текст со списком родителей
-                parents_text = "👨‍👩‍👧‍👦 *Список родителей*\n\n"
+                parents_text = header + "👨‍👩‍👧‍👦 *Список родителей*\n\n"
                 parents_text += "Выберите родителя для просмотра подробной информации и управления:\n\n"
 
                 # Создаем клавиатуру с кнопками для каждого родителя
@@ -2390,13 +2227,10 @@ class AdminHandler:
                     name = parent.full_name or parent.username or f"Родитель {parent.id}"
                     last_active = parent.last_active.strftime('%d.%m.%Y') if parent.last_active else "Никогда"
 
-                    # Получаем связанных учеников
-                    children_count = len(parent.children)
-
                     # Добавляем строку с информацией
                     parents_text += f"• {name} (ID: {parent.telegram_id})\n"
                     parents_text += f"  Последняя активность: {last_active}\n"
-                    parents_text += f"  Связанных учеников: {children_count}\n\n"
+                    parents_text += f"  Связанных учеников: {parent.children_count}\n\n"
 
                     # Добавляем кнопку для этого родителя
                     keyboard.append([
@@ -2420,8 +2254,7 @@ class AdminHandler:
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            logger.error(f"Error in show_parents_list: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in show_parents_list: %s", e)
             await query.edit_message_text(
                 f"Произошла ошибка при получении списка родителей: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз или обратитесь к разработчику."
@@ -77,8 +77,7 @@ class CommonHandler:
                         return False
 
         except Exception as e:
-            logger.error(f"Ошибка при проверке/создании пользователя: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка при проверке/создании пользователя: %s", e)
             return False
 
     # В CommonHandler добавим новый метод для обработки регистрации:
@@ -195,8 +194,7 @@ class CommonHandler:
                 return True
 
         except Exception as e:
-            logger.error(f"Ошибка при завершении регистрации: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка при завершении регистрации: %s", e)
             return False
 
     async def handle_common_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -228,8 +226,7 @@ class CommonHandler:
                 return
 
             except Exception as e:
-                logger.error(f"Ошибка при начале регистрации ученика: {e}")
-                logger.error(traceback.format_exc())
+                logger.exception("Ошибка при начале регистрации ученика: %s", e)
                 await query.edit_message_text(
                     "Произошла ошибка при регистрации. Пожалуйста, попробуйте еще раз или обратитесь к администратору."
                 )
@@ -254,8 +251,7 @@ class CommonHandler:
                         "Произошла ошибка при формировании рекомендаций. Пожалуйста, попробуйте позже."
                     )
             except Exception as e:
-                logger.error(f"Ошибка при обработке student_recommendations в CommonHandler: {e}")
-                logger.error(traceback.format_exc())
+                logger.exception("Ошибка при обработке student_recommendations в CommonHandler: %s", e)
                 await query.edit_message_text(
                     "Произошла ошибка при формировании рекомендаций. Пожалуйста, попробуйте позже."
                 )
@@ -311,8 +307,7 @@ class CommonHandler:
                 )
                 return
             except Exception as e:
-                logger.error(f"Ошибка при регистрации родителя: {e}")
-                logger.error(traceback.format_exc())
+                logger.exception("Ошибка при регистрации родителя: %s", e)
                 await query.edit_message_text(
                     "Произошла ошибка при регистрации. Пожалуйста, попробуйте еще раз или обратитесь к администратору."
                 )
@@ -365,8 +360,7 @@ class CommonHandler:
                             context.user_data["from_button"] = True  # Флаг для функции
                             await student_handler.start_test(update, context)
                     except Exception as e:
-                        logger.error(f"Ошибка при создании StudentHandler: {e}")
-                        logger.error(traceback.format_exc())
+                        logger.exception("Ошибка при создании StudentHandler: %s", e)
                         await query.edit_message_text(
                             "Произошла ошибка при запуске теста. Пожалуйста, попробуйте позже."
                         )
@@ -380,7 +374,7 @@ class CommonHandler:
                 if callback_data == "common_stats":
                     period = "all"
                 else:
-                    period = callback_data.replace("common_stats_", "")
+                    period = callback_data[len("common_stats_"):]
 
                 # Устанавливаем период в качестве аргумента
                 context.args = [period]
@@ -445,8 +439,7 @@ class CommonHandler:
                     await self.student_handler.start_test(update, context)
 
                 except Exception as e:
-                    logger.error(f"Ошибка при обработке start_test: {e}")
-                    logger.error(traceback.format_exc())
+                    logger.exception("Ошибка при обработке start_test: %s", e)
                     await query.edit_message_text(
                         "Произошла ошибка при запуске теста. Пожалуйста, попробуйте позже."
                     )
@@ -508,7 +501,7 @@ class CommonHandler:
                 if callback_data == "common_leaderboard":
                     period = "week"
                 else:
-                    period = callback_data.replace("common_leaderboard_", "")
+                    period = callback_data[len("common_leaderboard_"):]
 
                 # Устанавливаем период в качестве аргумента
                 context.args = [period]
@@ -555,8 +548,7 @@ class CommonHandler:
                 )
 
         except Exception as e:
-            logger.error(f"Error in handle_common_button: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in handle_common_button: %s", e)
             try:
                 await query.edit_message_text(
                     "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте еще раз."
@@ -866,8 +858,7 @@ class CommonHandler:
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            logger.error(f"Ошибка в show_leaderboard: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка в show_leaderboard: %s", e)
 
             error_message = "Произошла ошибка при отображении таблицы лидеров."
             if query:
@@ -1,6 +1,5 @@
 import logging
 import json
-import traceback
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
@@ -250,7 +249,7 @@ class ParentHandler:
         try:
             if query.data.startswith("parent_student_"):
                 # Выбор ученика для отчета
-                student_id = int(query.data.replace("parent_student_", ""))
+                student_id = int(query.data[len("parent_student_"):])
 
                 # Показываем меню выбора периода
                 reply_markup = parent_report_period_keyboard(student_id)
@@ -287,7 +286,7 @@ class ParentHandler:
 
             elif query.data.startswith("parent_settings_"):
                 # Настройки для выбранного ученика
-                student_id = int(query.data.replace("parent_settings_", ""))
+                student_id = int(query.data[len("parent_settings_"):])
                 # Получаем информацию об ученике
                 students_result = self.parent_service.get_linked_students(user_id)
                 if not students_result["success"]:
@@ -436,15 +435,13 @@ class ParentHandler:
                     await self.show_student_settings(update, context, student_id, student_name, query=query)
 
                 except Exception as e:
-                    logger.error(f"Ошибка обработки порогового значения: {e}")
-                    logger.error(traceback.format_exc())
+                    logger.exception("Ошибка обработки порогового значения: %s", e)
                     await query.edit_message_text(
                         f"Произошла ошибка при обработке настроек. Пожалуйста, попробуйте снова."
                     )
 
         except Exception as e:
-            logger.error(f"Error in handle_parent_button: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in handle_parent_button: %s", e)
             try:
                 await query.edit_message_text(
                     "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте еще раз."
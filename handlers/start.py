@@ -4,8 +4,8 @@ from telegram.ext import ContextTypes
 from datetime import datetime, timezone
 
 from database.models import User
-from database.db_manager import get_session
-from config import ADMINS
+from database.db_manager import get_session, run_in_session
+from config import ADMIN_IDS
 from keyboards.student_kb import student_main_keyboard
 from keyboards.parent_kb import parent_main_keyboard
 from keyboards.admin_kb import admin_main_keyboard
@@ -13,6 +13,36 @@ from keyboards.menu_kb import student_main_menu, parent_main_menu, admin_main_me
 
 logger = logging.getLogger(__name__)
 
+
+def _register_or_touch_user(session, user_id, username, full_name, role):
+    """Обновляет данные пользователя или создает его.
+
+    Возвращает (роль, создан ли пользователь). Для нового пользователя без роли
+    возвращает (None, False) - роль ему нужно выбрать самому.
+    """
+    db_user = session.query(User).filter(User.telegram_id == user_id).first()
+
+    if db_user:
+        # Обновляем информацию о пользователе
+        db_user.username = username
+        db_user.full_name = full_name
+        db_user.last_active = datetime.now(timezone.utc)
+        return db_user.role, False
+
+    if role is None:
+        return None, False
+
+    # Создаем нового пользователя
+    session.add(User(
+        telegram_id=user_id,
+        username=username,
+        full_name=full_name,
+        role=role,
+        created_at=datetime.now(timezone.utc),
+        last_active=datetime.now(timezone.utc)
+    ))
+    return role, True
+
 class StartHandler:
     def __init__(self):
         pass
@@ -26,99 +56,75 @@ class StartHandler:
         full_name = f"{user.first_name} {user.last_name if user.last_name else ''}"
 
         # Определим роль пользователя (админ/родитель/ученик)
-        role = "admin" if str(user_id) in ADMINS else None
+        role = "admin" if user_id in ADMIN_IDS else None
 
-        # Проверяем, существует ли пользователь в базе
-        with get_session() as session:
-            db_user = session.query(User).filter(User.telegram_id == user_id).first()
-
-            if not db_user:
-                # Если пользователь новый, предлагаем выбрать роль (если не админ)
-                if role is None:
-                    # Предлагаем выбрать роль
-                    keyboard = [
-                        [
-                            InlineKeyboardButton("👨‍🎓 Я ученик", callback_data="common_role_student"),
-                            InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="common_role_parent")
-                        ]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-
-                    await update.message.reply_text(
-                        f"Здравствуйте, {full_name}! 👋\n\n"
-                        "Добро пожаловать в бот для проверки знаний по истории.\n\n"
-                        "Пожалуйста, выберите, кем вы являетесь:",
-                        reply_markup=reply_markup
-                    )
-                    return
-
-                # Создаем нового пользователя
-                new_user = User(
-                    telegram_id=user_id,
-                    username=username,
-                    full_name=full_name,
-                    role=role or "student",  # По умолчанию считаем ученика
-                    created_at=datetime.now(timezone.utc),
-                    last_active=datetime.now(timezone.utc)
+        # Работа с базой выполняется в отдельном потоке, чтобы не блокировать цикл событий
+        user_role, created = await run_in_session(_register_or_touch_user, user_id, username, full_name, role)
+
+        if user_role is None:
+            # Если пользователь новый, предлагаем выбрать роль (если не админ)
+            keyboard = [
+                [
+                    InlineKeyboardButton("👨‍🎓 Я ученик", callback_data="common_role_student"),
+                    InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="common_role_parent")
+                ]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+
+            await update.message.reply_text(
+                f"Здравствуйте, {full_name}! 👋\n\n"
+                "Добро пожаловать в бот для проверки знаний по истории.\n\n"
+                "Пожалуйста, выберите, кем вы являетесь:",
+                reply_markup=reply_markup
+            )
+            return
+
+        # Устанавливаем команды бота для роли пользователя
+        from keyboards.menu_kb import set_commands_for_user
+        await set_commands_for_user(update.get_bot(), user_id, user_role)
+
+        if created:
+            # Сообщаем о создании нового аккаунта
+            if user_role == "admin":
+                # Отправляем сообщение и устанавливаем постоянную клавиатуру
+                await update.message.reply_text(
+                    f"Здравствуйте, {full_name}! 👋\n\n"
+                    "Вы зарегистрированы как администратор.\n"
+                    "Используйте команду /admin для доступа к панели управления.",
+                    reply_markup=admin_main_menu()
                 )
-                session.add(new_user)
-                session.commit()
-
-                # Устанавливаем команды бота для роли пользователя
-                from keyboards.menu_kb import set_commands_for_user
-                await set_commands_for_user(update.get_bot(), user_id, role or "student")
-
-                # Сообщаем о создании нового аккаунта
-                if role == "admin":
-                    # Отправляем сообщение и устанавливаем постоянную клавиатуру
-                    await update.message.reply_text(
-                        f"Здравствуйте, {full_name}! 👋\n\n"
-                        "Вы зарегистрированы как администратор.\n"
-                        "Используйте команду /admin для доступа к панели управления.",
-                        reply_markup=admin_main_menu()
-                    )
-                else:
-                    await update.message.reply_text(
-                        f"Здравствуйте, {full_name}! 👋\n\n"
-                        "Добро пожаловать в бот для проверки знаний по истории.\n"
-                        "Ваш аккаунт успешно создан.",
-                        reply_markup=student_main_menu()  # По умолчанию меню ученика
-                    )
-                    await self.show_main_menu(update, role or "student")
             else:
-                # Обновляем информацию о пользователе
-                db_user.username = username
-                db_user.full_name = full_name
-                db_user.last_active = datetime.now(timezone.utc)
-                session.commit()
-
-                # Устанавливаем команды бота для роли пользователя
-                from keyboards.menu_kb import set_commands_for_user
-                await set_commands_for_user(update.get_bot(), user_id, db_user.role)
-
-                # Выбираем постоянную клавиатуру в зависимости от роли пользователя
-                if db_user.role == "admin":
-                    menu_keyboard = admin_main_menu()
-                elif db_user.role == "parent":
-                    menu_keyboard = parent_main_menu()
-                else:
-                    menu_keyboard = student_main_menu()
-
-                # Приветствуем существующего пользователя
-                if db_user.role == "admin":
-                    await update.message.reply_text(
-                        f"Здравствуйте, {full_name}! 👋\n\n"
-                        "Вы авторизованы как администратор.\n"
-                        "Используйте команду /admin для доступа к панели управления.",
-                        reply_markup=menu_keyboard
-                    )
-                else:
-                    await update.message.reply_text(
-                        f"Здравствуйте, {full_name}! 👋\n\n"
-                        "Рады видеть вас снова в боте для проверки знаний по истории.",
-                        reply_markup=menu_keyboard
-                    )
-                    await self.show_main_menu(update, db_user.role)
+                await update.message.reply_text(
+                    f"Здравствуйте, {full_name}! 👋\n\n"
+                    "Добро пожаловать в бот для проверки знаний по истории.\n"
+                    "Ваш аккаунт успешно создан.",
+                    reply_markup=student_main_menu()  # По умолчанию меню ученика
+                )
+                await self.show_main_menu(update, user_role)
+        else:
+            # Выбираем постоянную клавиатуру в зависимости от роли пользователя
+            if user_role == "admin":
+                menu_keyboard = admin_main_menu()
+            elif user_role == "parent":
+                menu_keyboard = parent_main_menu()
+            else:
+                menu_keyboard = student_main_menu()
+
+            # Приветствуем существующего пользователя
+            if user_role == "admin":
+                await update.message.reply_text(
+                    f"Здравствуйте, {full_name}! 👋\n\n"
+                    "Вы авторизованы как администратор.\n"
+                    "Используйте команду /admin для доступа к панели управления.",
+                    reply_markup=menu_keyboard
+                )
+            else:
+                await update.message.reply_text(
+                    f"Здравствуйте, {full_name}! 👋\n\n"
+                    "Рады видеть вас снова в боте для проверки знаний по истории.",
+                    reply_markup=menu_keyboard
+                )
+                await self.show_main_menu(update, user_role)
 
     def get_help_text(self, role: str) -> str:
         """Возвращает текст справки в зависимости от роли пользователя"""
@@ -1,5 +1,4 @@
 import logging
-import traceback
 from datetime import datetime, timezone
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -8,8 +7,8 @@ from io import BytesIO
 
 from services.quiz_service import QuizService
 from services.stats_service import get_user_stats
-from database.models import User, TestResult, Topic, Achievement
-from database.db_manager import get_session
+from database.models import User, TestResult, Achievement
+from database.db_manager import get_session, get_cached_topic
 from keyboards.student_kb import (
     student_main_keyboard, topic_selection_keyboard, single_question_keyboard,
     multiple_question_keyboard, sequence_question_keyboard, test_results_keyboard,
@@ -86,8 +85,7 @@ class StudentHandler:
                 )
 
         except Exception as e:
-            logger.error(f"Error in start_test: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in start_test: %s", e)
 
             error_message = "Произошла ошибка при запуске теста. Пожалуйста, попробуйте еще раз позже."
 
@@ -118,15 +116,14 @@ class StudentHandler:
                     logger.info(f"Обработка кнопки student_recommendations в StudentHandler: user_id={user_id}")
                     await self.show_recommendations(update, context)
                 except Exception as e:
-                    logger.error(f"Ошибка при обработке кнопки student_recommendations: {e}")
-                    logger.error(traceback.format_exc())
+                    logger.exception("Ошибка при обработке кнопки student_recommendations: %s", e)
                     await query.edit_message_text(
                         "Произошла ошибка при формировании рекомендаций. Пожалуйста, попробуйте позже."
                     )
 
             elif query.data.startswith("quiz_start_"):
                 # Начало теста по выбранной теме
-                topic_id_str = query.data.replace("quiz_start_", "")
+                topic_id_str = query.data[len("quiz_start_"):]
                 # Обрабатываем случайную тему
                 if topic_id_str == "random":
                     import random
@@ -145,7 +142,7 @@ class StudentHandler:
 
             elif query.data.startswith("quiz_confirm_start_"):
                 # Подтверждение начала теста
-                topic_id = int(query.data.replace("quiz_confirm_start_", ""))
+                topic_id = int(query.data[len("quiz_confirm_start_"):])
                 # Начинаем тест
                 quiz_data = self.quiz_service.start_quiz(user_id, topic_id)
                 if not quiz_data["success"]:
@@ -161,7 +158,7 @@ class StudentHandler:
 
             elif query.data.startswith("quiz_repeat_"):
                 # Повторное прохождение теста
-                topic_id = int(query.data.replace("quiz_repeat_", ""))
+                topic_id = int(query.data[len("quiz_repeat_"):])
                 # Начинаем тест
                 quiz_data = self.quiz_service.start_quiz(user_id, topic_id)
                 if not quiz_data["success"]:
@@ -454,13 +451,12 @@ class StudentHandler:
         try:
             user_id = update.effective_user.id
 
-            # Получаем название темы
-            with get_session() as session:
-                topic = session.query(Topic).get(topic_id)
-                if not topic:
-                    await update.callback_query.edit_message_text("Тема не найдена.")
-                    return
-                topic_name = topic.name
+            # Получаем название темы из кэша
+            topic = get_cached_topic(topic_id)
+            if not topic:
+                await update.callback_query.edit_message_text("Тема не найдена.")
+                return
+            topic_name = topic["name"]
 
             # Получаем настройки теста
             from services.settings_service import get_quiz_settings
@@ -626,9 +622,9 @@ class StudentHandler:
                 # Получаем название темы
                 topic_name = "Неизвестная тема"
                 if last_test.topic_id:
-                    topic = session.query(Topic).get(last_test.topic_id)
+                    topic = get_cached_topic(last_test.topic_id)
                     if topic:
-                        topic_name = topic.name
+                        topic_name = topic["name"]
 
                 # Форматируем время
                 time_str = "Не определено"
@@ -665,8 +661,7 @@ class StudentHandler:
                 )
 
         except Exception as e:
-            logger.error(f"Ошибка при показе детальных результатов: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка при показе детальных результатов: %s", e)
             try:
                 await query.edit_message_text(
                     "Произошла ошибка при получении детальных результатов. Пожалуйста, попробуйте позже.",
@@ -873,8 +868,7 @@ class StudentHandler:
                 )
 
         except Exception as e:
-            logger.error(f"Error showing recommendations: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error showing recommendations: %s", e)
             message = "Произошла ошибка при формировании рекомендаций. Пожалуйста, попробуйте позже."
 
             if query:
@@ -1,7 +1,6 @@
 import logging
 import asyncio
 import json
-import traceback
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -10,11 +9,18 @@ from telegram.error import BadRequest, Forbidden, TelegramError, TimedOut, Netwo
 from telegram.ext import Application
 
 from database.models import User, Notification
-from database.db_manager import get_session
+from database.db_manager import get_session, eager_user
 from services.parent_service import ParentService
 
 logger = logging.getLogger(__name__)
 
+# Количество воркеров, разбирающих очередь уведомлений
+NOTIFICATION_WORKERS = 8
+# Максимальный размер пачки, отправляемой одним воркером за раз
+NOTIFICATION_BATCH_SIZE = 30
+# Лимит Telegram на рассылку: не более 30 сообщений в секунду
+MESSAGES_PER_SECOND = 30
+
 
 class NotificationService:
     """Сервис для отправки уведомлений пользователям"""
@@ -31,7 +37,9 @@ class NotificationService:
         self.parent_service = ParentService()
         # Добавляем очередь для уведомлений
         self._notification_queue = asyncio.Queue()
-        self._worker_task = None
+        self._worker_tasks = []
+        # Скользящее окно в одну секунду для соблюдения лимита Telegram
+        self._rate_limiter = asyncio.Semaphore(MESSAGES_PER_SECOND)
 
     async def start(self):
         """Запуск планировщика уведомлений"""
@@ -44,8 +52,11 @@ class NotificationService:
                 logger.critical("Cannot start notification service: application is None")
                 return
 
-            # Запускаем воркер для обработки уведомлений
-            self._worker_task = asyncio.create_task(self._notification_worker())
+            # Запускаем воркеры для обработки уведомлений
+            self._worker_tasks = [
+                asyncio.create_task(self._notification_worker())
+                for _ in range(NOTIFICATION_WORKERS)
+            ]
 
             # Создаем планировщик
             from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -96,8 +107,7 @@ class NotificationService:
             logger.info("Notification scheduler started successfully")
 
         except Exception as e:
-            logger.error(f"Error starting notification scheduler: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error starting notification scheduler: %s", e)
             self._running = False
 
     async def process_notifications(self):
@@ -118,7 +128,7 @@ class NotificationService:
                 for notification in notifications:
                     try:
                         # Получаем пользователя
-                        user = session.query(User).get(notification.user_id)
+                        user = session.get(User, notification.user_id)
                         if not user:
                             logger.warning(f"User {notification.user_id} not found for notification {notification.id}")
                             notification.is_read = True
@@ -136,15 +146,13 @@ class NotificationService:
                         logger.info(f"Notification {notification.id} added to queue for user {user.telegram_id}")
 
                     except Exception as e:
-                        logger.error(f"Error processing notification {notification.id}: {e}")
-                        logger.error(traceback.format_exc())
+                        logger.exception("Error processing notification %s: %s", notification.id, e)
 
                 # Сохраняем изменения
                 session.commit()
 
         except Exception as e:
-            logger.error(f"Error in process_notifications: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in process_notifications: %s", e)
 
     async def send_monthly_reports(self):
         """Отправка ежемесячных отчетов родителям"""
@@ -155,7 +163,7 @@ class NotificationService:
             logger.info("Starting monthly reports generation in NotificationService")
             with get_session() as session:
                 # Получаем всех родителей
-                parents = session.query(User).filter(User.role == "parent").all()
+                parents = session.query(User).options(*eager_user("children")).filter(User.role == "parent").all()
 
                 for parent in parents:
                     # Пропускаем родителей без настроек
@@ -206,17 +214,15 @@ class NotificationService:
                         except ValueError:
                             logger.error(f"Invalid student ID format: {student_id_str}")
                         except Exception as e:
-                            logger.error(
-                                f"Error generating monthly report notification for student {student_id_str}: {e}")
-                            logger.error(traceback.format_exc())
+                            logger.exception(
+                                "Error generating monthly report notification for student %s: %s", student_id_str, e)
 
                     # Сохраняем изменения
                     session.commit()
 
             logger.info("Monthly reports generation completed in NotificationService")
         except Exception as e:
-            logger.error(f"Error sending monthly reports: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error sending monthly reports: %s", e)
 
     # обертки для асинхронных функций
     def _process_notifications_wrapper(self):
@@ -233,13 +239,12 @@ class NotificationService:
         try:
             self._running = False
 
-            # Останавливаем воркер
-            if self._worker_task:
-                self._worker_task.cancel()
-                try:
-                    await self._worker_task
-                except asyncio.CancelledError:
-                    pass
+            # Останавливаем воркеры
+            for task in self._worker_tasks:
+                task.cancel()
+            if self._worker_tasks:
+                await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+            self._worker_tasks = []
 
             # Останавливаем планировщик
             if self.scheduler:
@@ -247,21 +252,26 @@ class NotificationService:
                 logger.info("Notification scheduler stopped")
 
         except Exception as e:
-            logger.error(f"Error stopping notification scheduler: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error stopping notification scheduler: %s", e)
 
     async def _notification_worker(self):
-        """Воркер для асинхронной обработки уведомлений из очереди"""
+        """Воркер для асинхронной обработки уведомлений из очереди пачками"""
         while self._running:
             try:
-                # Получаем уведомление из очереди с таймаутом
-                notification_data = await asyncio.wait_for(
+                # Ждем первое уведомление из очереди с таймаутом
+                batch = [await asyncio.wait_for(
                     self._notification_queue.get(),
                     timeout=1.0
-                )
+                )]
 
-                # Обрабатываем уведомление
-                await self._process_single_notification(notification_data)
+                # Забираем без ожидания то, что уже накопилось в очереди
+                while len(batch) < NOTIFICATION_BATCH_SIZE and not self._notification_queue.empty():
+                    batch.append(self._notification_queue.get_nowait())
+
+                # Отправляем пачку параллельно
+                await asyncio.gather(
+                    *(self._process_rate_limited(notification_data) for notification_data in batch)
+                )
 
             except asyncio.TimeoutError:
                 # Таймаут - это нормально, продолжаем цикл
@@ -270,11 +280,17 @@ class NotificationService:
                 # Воркер отменен - выходим
                 break
             except Exception as e:
-                logger.error(f"Error in notification worker: {e}")
-                logger.error(traceback.format_exc())
+                logger.exception("Error in notification worker: %s", e)
                 # Небольшая пауза при ошибке
                 await asyncio.sleep(1)
 
+    async def _process_rate_limited(self, notification_data: dict):
+        """Обработка уведомления с ограничением числа отправок в секунду"""
+        await self._rate_limiter.acquire()
+        # Слот освобождается через секунду, а не по завершении отправки
+        asyncio.get_running_loop().call_later(1, self._rate_limiter.release)
+        await self._process_single_notification(notification_data)
+
     async def _process_single_notification(self, notification_data: dict):
         """Обработка одного уведомления"""
         try:
@@ -302,7 +318,7 @@ class NotificationService:
             # Используем asyncio.to_thread для синхронной операции с БД
             def mark_read():
                 with get_session() as session:
-                    notification = session.query(Notification).get(notification_id)
+                    notification = session.get(Notification, notification_id)
                     if notification:
                         notification.is_read = True
                         session.commit()
@@ -383,8 +399,7 @@ class NotificationService:
                     await asyncio.sleep(5)  # Пауза при сетевой ошибке
 
             except Exception as e:
-                logger.error(f"Unexpected error sending notification: {e}")
-                logger.error(traceback.format_exc())
+                logger.exception("Unexpected error sending notification: %s", e)
 
                 if attempt < max_retries - 1:
                     await asyncio.sleep(1)
@@ -425,8 +440,7 @@ class NotificationService:
             await self.parent_service.send_weekly_reports()
             logger.info("Weekly reports generation completed in NotificationService")
         except Exception as e:
-            logger.error(f"Error sending weekly reports: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error sending weekly reports: %s", e)
 
     async def send_reminders(self):
         """Отправка напоминаний о необходимости пройти тест"""
@@ -451,18 +465,16 @@ class NotificationService:
                         )
                         logger.info(f"Reminder sent to student {student.telegram_id}")
                     except Exception as e:
-                        logger.error(f"Error sending reminder to student {student.telegram_id}: {e}")
-                        logger.error(traceback.format_exc())
+                        logger.exception("Error sending reminder to student %s: %s", student.telegram_id, e)
 
         except Exception as e:
-            logger.error(f"Error sending reminders: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error sending reminders: %s", e)
 
     async def _add_to_retry_queue(self, notification_id, retry_after=300):
         """Добавление уведомления в очередь для повторной обработки"""
         try:
             with get_session() as session:
-                notification = session.query(Notification).get(notification_id)
+                notification = session.get(Notification, notification_id)
                 if notification:
                     # Устанавливаем время следующей попытки
                     notification.scheduled_at = datetime.now(timezone.utc) + timedelta(seconds=retry_after)
@@ -472,8 +484,7 @@ class NotificationService:
                     logger.info(f"Уведомление {notification_id} добавлено в очередь повторной обработки")
                     return True
         except Exception as e:
-            logger.error(f"Ошибка при добавлении уведомления {notification_id} в очередь повторной обработки: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка при добавлении уведомления %s в очередь повторной обработки: %s", notification_id, e)
         return False
 
     async def create_notification(self, user_id: int, title: str, message: str,
@@ -482,7 +493,7 @@ class NotificationService:
         try:
             with get_session() as session:
                 # Проверяем существование пользователя
-                user = session.query(User).get(user_id)
+                user = session.get(User, user_id)
                 if not user:
                     return False
 
@@ -516,7 +527,7 @@ class NotificationService:
         try:
             # Получаем данные ученика
             with get_session() as session:
-                student = session.query(User).get(student_id)
+                student = session.get(User, student_id)
                 if not student or student.role != "student":
                     logger.warning(f"Ученик {student_id} не найден или не является учеником")
                     return
@@ -615,5 +626,4 @@ class NotificationService:
                 logger.info(f"Уведомления о результатах теста обработаны для ученика {student_id}")
 
         except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления о завершении теста: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Ошибка при отправке уведомления о завершении теста: %s", e)
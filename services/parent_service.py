@@ -5,10 +5,9 @@ import matplotlib.pyplot as plt
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from typing import List, Dict, Any, Optional, Tuple
-import traceback
 
-from database.models import User, TestResult, Topic, Notification
-from database.db_manager import get_session
+from database.models import User, TestResult, Notification
+from database.db_manager import get_session, get_topic_names, eager_user
 from services.stats_service import get_user_stats
 
 logger = logging.getLogger(__name__)
@@ -98,8 +97,7 @@ class ParentService:
                     "message": f"Ученик {student_name} успешно привязан к вашему аккаунту"
                 }
         except Exception as e:
-            logger.error(f"Error linking student: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error linking student: %s", e)
             return {"success": False, "message": f"Произошла ошибка: {str(e)}"}
 
     def generate_detailed_report(self, parent_id: int, student_id: int, period: str = "week") -> Dict[str, Any]:
@@ -253,8 +251,7 @@ class ParentService:
                                     "percentile": round(100 - (student_position - 1) * 100 / len(students_data), 1)
                                 }
                 except Exception as chart_error:
-                    logger.error(f"Error creating comparison chart: {chart_error}")
-                    logger.error(traceback.format_exc())
+                    logger.exception("Error creating comparison chart: %s", chart_error)
 
                 # Добавляем график в результат, если он был создан
                 if comparison_chart:
@@ -263,8 +260,7 @@ class ParentService:
                 return result
 
         except Exception as e:
-            logger.error(f"Error generating detailed report: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error generating detailed report: %s", e)
             return {"success": False, "message": f"Произошла ошибка при создании отчета: {str(e)}"}
 
     def get_linked_students(self, parent_id: int) -> Dict[str, Any]:
@@ -337,7 +333,7 @@ class ParentService:
                     }
 
                 # Собираем данные для отчета
-                topics = {topic.id: topic.name for topic in session.query(Topic).all()}
+                topics = get_topic_names()
 
                 # Преобразуем результаты в DataFrame для анализа
                 df = pd.DataFrame([
@@ -407,8 +403,7 @@ class ParentService:
                 }
 
         except Exception as e:
-            logger.error(f"Error generating student report: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error generating student report: %s", e)
             return {"success": False, "message": f"Произошла ошибка при создании отчета: {str(e)}"}
 
     def setup_notifications(self, parent_id: int, student_id: int, settings: Dict[str, Any]) -> Dict[str, Any]:
@@ -495,7 +490,7 @@ class ParentService:
                             continue
 
                         # Генерируем отчет
-                        student = session.query(User).get(student_id)
+                        student = session.get(User, student_id)
                         if not student:
                             continue
 
@@ -519,7 +514,7 @@ class ParentService:
         try:
             with get_session() as session:
                 # Находим ученика
-                student = session.query(User).get(student_id)
+                student = session.get(User, student_id)
                 if not student:
                     return
 
@@ -605,7 +600,7 @@ class ParentService:
 
             with get_session() as session:
                 # Получаем всех родителей
-                parents = session.query(User).filter(User.role == "parent").all()
+                parents = session.query(User).options(*eager_user("children")).filter(User.role == "parent").all()
 
                 for parent in parents:
                     # Пропускаем родителей без настроек
@@ -664,17 +659,15 @@ class ParentService:
                         except ValueError:
                             logger.error(f"Invalid student ID format: {student_id_str}")
                         except Exception as e:
-                            logger.error(
-                                f"Error generating weekly report notification for student {student_id_str}: {e}")
-                            logger.error(traceback.format_exc())
+                            logger.exception(
+                                "Error generating weekly report notification for student %s: %s", student_id_str, e)
 
                     # Сохраняем изменения
                     session.commit()
 
                 logger.info("Weekly reports generation completed")
         except Exception as e:
-            logger.error(f"Error sending weekly reports: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error sending weekly reports: %s", e)
 
 
 
@@ -2,14 +2,13 @@ import json
 import random
 import os
 import logging
-import traceback
 import asyncio
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Optional, Tuple
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from database.models import Question, TestResult, User, Topic, Achievement
-from database.db_manager import get_session
+from database.models import Question, TestResult, User, Achievement
+from database.db_manager import get_session, cached_topics, get_cached_topics
 from services.cache_service import CacheService
 from services.notification import NotificationService
 from services.stats_service import update_user_stats
@@ -126,8 +125,7 @@ class QuizService:
             logger.info(f"Saved {saved_count}/{len(self.active_quizzes)} active quizzes")
 
         except Exception as e:
-            logger.error(f"Error saving active quizzes: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error saving active quizzes: %s", e)
 
     def _prepare_quiz_data_for_save(self, quiz_data: Dict[str, Any]) -> Dict[str, Any]:
         """Подготовка данных теста для сохранения"""
@@ -226,8 +224,7 @@ class QuizService:
             logger.info(f"Restored {restored_count} active quizzes, {expired_count} expired")
 
         except Exception as e:
-            logger.error(f"Error restoring active quizzes: {e}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error restoring active quizzes: %s", e)
 
     def _restore_quiz_data_from_save(self, quiz_data: Dict[str, Any]) -> Dict[str, Any]:
         """Восстановление данных теста из сохраненного состояния"""
@@ -266,20 +263,11 @@ class QuizService:
     async def get_topics_async(self) -> List[Dict[str, Any]]:
         """Асинхронное получение списка тем"""
         try:
-            # Используем asyncio.to_thread для синхронной операции с БД
-            def fetch_topics():
-                with get_session() as session:
-                    topics = session.query(Topic).all()
-                    return [
-                        {
-                            "id": t.id,
-                            "name": t.name,
-                            "description": t.description
-                        }
-                        for t in topics
-                    ]
-
-            return await asyncio.to_thread(fetch_topics)
+            # Темы загружены в память при старте, обращение к БД не нужно
+            if cached_topics.cache_info().currsize:
+                return get_cached_topics()
+            # После сброса кэша темы перечитываются из базы - в отдельном потоке
+            return await asyncio.to_thread(get_cached_topics)
         except Exception as e:
             logger.error(f"Error fetching topics: {e}")
             return []
@@ -690,6 +678,8 @@ class QuizService:
                 completed_at=datetime.now(timezone.utc)  # Явно указываем время
             )
             session.add(test_result)
+            # Записываем результат сразу: подсчет тестов ниже должен его учитывать
+            session.flush()
 
             # Проверяем достижения в той же сессии, вместо вызова отдельного метода
             new_achievements = []
@@ -757,8 +747,7 @@ class QuizService:
                 )
 
             except Exception as e:
-                logger.error(f"Ошибка при создании задачи отправки уведомления: {e}")
-                logger.error(traceback.format_exc())
+                logger.exception("Ошибка при создании задачи отправки уведомления: %s", e)
 
         # Удаляем тест из активных
         del self.active_quizzes[user_id]
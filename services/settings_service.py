@@ -1,54 +1,86 @@
+import bisect
 import logging
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict
+from sqlalchemy import select
+from config import ENABLE_PARENT_REPORTS
 from database.models import BotSettings
-from database.db_manager import get_session
+from database.db_manager import dialect_insert, get_session, get_session_readonly
 
 logger = logging.getLogger(__name__)
 
+# Кэш настроек в памяти процесса: таблица небольшая, загружается целиком при первом обращении
+_settings_cache: Dict[str, str] = {}
+_settings_loaded = False
+# Ограничение времени теста: до 10 вопросов - 5 минут, до 15 - 10 минут, больше - 20 минут
+_TIME_LIMIT_THRESHOLDS = (10, 15)
+_TIME_LIMITS = (5 * 60, 10 * 60, 20 * 60)  # в секундах
+
+
+def _load_all_settings():
+    """Загрузка всех настроек в кэш одним запросом"""
+    global _settings_cache, _settings_loaded
+
+    with get_session_readonly() as conn:
+        rows = conn.execute(select(BotSettings.key, BotSettings.value)).all()
+    # Новый словарь подменяет старый целиком: читатель из другого потока
+    # не увидит промежуточного пустого кэша
+    _settings_cache = dict(rows)
+    _settings_loaded = True
+
 
 def get_setting(key: str, default=None):
     """Получение настройки по ключу"""
-    try:
-        with get_session() as session:
-            setting = session.query(BotSettings).filter(BotSettings.key == key).first()
-            if setting:
-                return setting.value
+    if not _settings_loaded:
+        try:
+            _load_all_settings()
+        except Exception as e:
+            logger.error(f"Ошибка при получении настройки {key}: {e}")
             return default
-    except Exception as e:
-        logger.error(f"Ошибка при получении настройки {key}: {e}")
-        return default
+
+    return _settings_cache.get(key, default)
 
 
 def set_setting(key: str, value):
     """Установка настройки"""
     try:
+        # Один INSERT ... ON CONFLICT вместо чтения строки и отдельной записи
+        stmt = (
+            dialect_insert(BotSettings)
+            .values(key=key, value=str(value))
+            .on_conflict_do_update(
+                index_elements=["key"],
+                set_={"value": str(value), "updated_at": datetime.now(timezone.utc)}
+            )
+        )
         with get_session() as session:
-            setting = session.query(BotSettings).filter(BotSettings.key == key).first()
-            if setting:
-                setting.value = str(value)
-            else:
-                setting = BotSettings(key=key, value=str(value))
-                session.add(setting)
-            session.commit()
-            return True
+            session.execute(stmt)
+        # Обновляем кэш только после успешной записи в базу
+        _settings_cache[key] = str(value)
+        return True
     except Exception as e:
         logger.error(f"Ошибка при установке настройки {key}: {e}")
         return False
 
 
-def get_quiz_settings():
-    """Получение настроек теста"""
-    questions_count = int(get_setting("default_questions_count", "10"))
-
-    # Определение времени в зависимости от количества вопросов
-    if questions_count <= 10:
-        time_limit = 5 * 60  # 5 минут в секундах
-    elif questions_count <= 15:
-        time_limit = 10 * 60  # 10 минут в секундах
-    else:
-        time_limit = 20 * 60  # 20 минут в секундах
-
+@lru_cache(maxsize=8)
+def _quiz_settings_for(questions_count: int) -> dict:
+    """Настройки теста для заданного количества вопросов"""
+    time_limit = _TIME_LIMITS[bisect.bisect_left(_TIME_LIMIT_THRESHOLDS, questions_count)]
     return {
         "questions_count": questions_count,
         "time_limit": time_limit,
         "time_minutes": time_limit // 60
-    }
\ No newline at end of file
+    }
+
+
+def get_quiz_settings():
+    """Получение настроек теста"""
+    return _quiz_settings_for(int(get_setting("default_questions_count", "10")))
+
+
+def parent_reports_enabled() -> bool:
+    """Включены ли автоматические отчеты родителям (по умолчанию - значение из .env)"""
+    default = "true" if ENABLE_PARENT_REPORTS else "false"
+    return get_setting("enable_parent_reports", default) == "true"
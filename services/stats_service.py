@@ -1,5 +1,4 @@
 import json
-import pandas as pd
 import matplotlib.pyplot as plt
 from io import BytesIO
 from datetime import datetime, timedelta, timezone
@@ -7,8 +6,8 @@ from typing import Dict, Any
 import logging
 
 
-from database.models import User, TestResult, Topic, Achievement
-from database.db_manager import get_session
+from database.models import User, TestResult, Achievement
+from database.db_manager import get_session, get_topic_names
 
 logger = logging.getLogger(__name__)
 
@@ -46,7 +45,7 @@ def get_user_stats(user_id: int, period: str = "all") -> Dict[str, Any]:
                 }
 
             # Получаем информацию о темах
-            topics = {topic.id: topic.name for topic in session.query(Topic).all()}
+            topics = get_topic_names()
 
             # Собираем данные для статистики
             results_data = []
@@ -61,6 +60,8 @@ def get_user_stats(user_id: int, period: str = "all") -> Dict[str, Any]:
                     "time_spent": result.time_spent
                 })
 
+            # pandas нужен только здесь - не тянем его в процесс при импорте модуля
+            import pandas as pd
             df = pd.DataFrame(results_data)
 
             # Рассчитываем общую статистику
@@ -253,13 +254,15 @@ def get_user_stats_optimized(user_id: int, period: str = "all") -> Dict[str, Any
 
 
 def get_problematic_questions(limit: int = 10) -> Dict[str, Any]:
-    """Получение списка самых проблемных вопросов (с наибольшим процентом ошибок)"""
-    global traceback, traceback
+    """Получение списка самых проблемных вопросов (с наибольшим процентом ошибок).
+
+    Вопросы в problematic_questions уже отсортированы по error_rate по убыванию
+    (ORDER BY в запросе), повторная сортировка на стороне вызывающего не нужна.
+    """
     try:
         with get_session() as session:
             # Импортируем необходимые компоненты
             from sqlalchemy import func, text, case
-            import traceback
 
             # Определяем, какую СУБД используем (SQLite или PostgreSQL)
             from sqlalchemy import inspect
@@ -386,8 +389,7 @@ def get_problematic_questions(limit: int = 10) -> Dict[str, Any]:
                 except ValueError as val_err:
                     logger.error(f"Ошибка данных для графика: {val_err}")
                 except Exception as chart_error:
-                    logger.error(f"Ошибка при создании графика для проблемных вопросов: {chart_error}")
-                    logger.error(traceback.format_exc())
+                    logger.exception("Ошибка при создании графика для проблемных вопросов: %s", chart_error)
 
             return {
                 "success": True,
@@ -397,8 +399,7 @@ def get_problematic_questions(limit: int = 10) -> Dict[str, Any]:
             }
 
     except Exception as e:
-        logger.error(f"Ошибка при получении проблемных вопросов: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Ошибка при получении проблемных вопросов: %s", e)
         return {"success": False, "message": f"Ошибка при получении проблемных вопросов: {str(e)}"}
 
 
@@ -432,8 +433,7 @@ def update_user_stats(user_id: int) -> Dict[str, Any]:
                 raise e  # Переброс исключения для дальнейшей обработки
 
     except Exception as e:
-        logger.error(f"Ошибка при обновлении статистики: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Ошибка при обновлении статистики: %s", e)
         return {"success": False, "message": f"Ошибка при обновлении статистики: {str(e)}"}
 
 
@@ -477,7 +477,7 @@ def generate_leaderboard(period: str = "week", limit: int = 10) -> Dict[str, Any
             # Рассчитываем средний балл для каждого пользователя
             leaderboard_data = []
             for user_id, results in user_results.items():
-                user = session.query(User).get(user_id)
+                user = session.get(User, user_id)
                 if not user or user.role != "student":
                     continue
 
@@ -530,7 +530,7 @@ def generate_topic_analytics() -> Dict[str, Any]:
                 }
 
             # Получаем информацию о темах
-            topics = {topic.id: topic.name for topic in session.query(Topic).all()}
+            topics = get_topic_names()
 
             # Группируем результаты по темам
             topic_results = {}
@@ -1,6 +1,5 @@
 import os
 import logging
-import traceback
 from typing import Optional, Tuple, Union
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
@@ -54,8 +53,7 @@ def ensure_media_directories() -> None:
             with open(placeholder_path, 'wb') as f:
                 f.write(buffer.getvalue())
     except Exception as e:
-        logger.error(f"Error ensuring media directories: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error ensuring media directories: %s", e)
 
 # В функцию get_image_path добавим создание заглушки
 def get_image_path(file_name: str) -> str: